@@ -4,6 +4,9 @@
 
 import numpy as np
 from numpy import linalg as la
+from quadUtil import QuadObjective
+from permII import permEngine, permVal
+from gradCheck import gradCheck
 
 def randQuad(n):
     """ Takes an integer n as input and returns an nxn matrix, Q,
@@ -20,43 +23,18 @@ def myQuad(x,Q,b):
         the function f(x) = 0.5*x^T*Q*x - b^T*x and g is the gradient
         of f at x.
     """
-    #Make sure the input is numpy compatible
-    x = np.array(x)
-    Q = np.array(Q)
-    b = np.array(b)
-    # Run f(x)
-    r = 0.5 * np.matmul(x.transpose(), np.matmul(Q, x)) - np.matmul(b.transpose(), x)
-    # Since we're hoping for a symmetric, positive definite Q, I'm taking
-    # the shortcut to the gradient where d/dx[x^TAx] = 2Ax if A is symmetric
-    # and positive definite.
-    g = np.matmul(Q,x) - b
-    return r,g
+    # Thin wrapper, QuadObjective does the work without copying Q. If
+    # you're calling this in a loop build a QuadObjective once instead.
+    return QuadObjective(Q,b)(x)
 
 def myPerm(x):
     """ Takes the nx1 vector x as input and returns r,g where r is the value
         of the PermII function evaluated at x and g is the gradient of the
         PermII function at x.
     """
-    # Generate output
-    r = 0
-    g = np.zeros(x.shape)
-    n = x.size
-    # Loop the function and compute
-    for i in range(1,n+1):
-        r_i = 0
-        g_i = np.zeros(x.shape)
-        for j in range(1,n+1):
-            # Inner sum that gets squared before adding to outer sum
-            r_i += (j + 10)*(x[j-1]**i - (1/(j**i)))
-        #g[i-1] = 2*r_i + (i+10)*i*(x[i-1]**i-1)
-        g_i[:] = 2*r_i
-        r += r_i**2
-        for l in range(1,n+1):
-            #Add the inside part of the chain rule expression
-            g_i[l-1] = g_i[l-1]*(10 + l)*(i * x[l-1]**(i-1))
-        g += g_i
-            
-    return r,g
+    # The weights and j^-i table get built once per dimension, after that
+    # it's just a power table and a few array ops (see permII.py)
+    return permEngine(np.size(x))(x)
 
 def myArmijo(x,p,a,r,f):
     """ An implementation of Armijo line search with c=1e-4
@@ -119,22 +97,8 @@ def gradTestQ(x):
     x = np.array(x)
     n = x.size
     Q,b = randQuad(n)
-    # Build some tools
-    outShape = x.shape
-    dells = np.zeros(x.shape)
-    # Loop x
-    for i in range(x.size):
-        d_i = np.zeros(x.shape)
-        d_i[i] = abs(np.random.rand() * 1e-4)
-        delta = d_i[i]
-        xp = x + d_i
-        xm = x - d_i
-        val1 = 0.5 * np.matmul(xp.transpose(), np.matmul(Q, xp)) - np.matmul(b.transpose(), xp)
-        val2 = 0.5 * np.matmul(xm.transpose(), np.matmul(Q, xm)) - np.matmul(b.transpose(), xm)
-        fval = (val1 - val2) / delta
-        dells[i] = fval
-    _,g = myQuad(x,Q,b)
-    eps = abs(g-dells)
+    # All 2n perturbed points go through QuadObjective.batch in one go
+    _,eps,_ = gradCheck(QuadObjective(Q,b), x)
     print(eps)
     return
 
@@ -142,33 +106,14 @@ def gradTestP(x):
     """ Verifies the gradient against an approximate calculation.
     """
     x = np.array(x)
-    # Build some tools
-    dells = np.zeros(x.shape)
-    delta = abs(np.random.rand() * 1e-7)
-    # Loop x
-    for i in range(x.size):
-        d_i = np.zeros(x.shape)
-        d_i[i] = delta
-        xp = x + d_i
-        xm = x - d_i
-        val1 = permIt(xp)
-        val2 = permIt(xm)
-        fval = (val1 - val2) / (2*delta)
-        dells[i] = fval
+    dells,_,_ = gradCheck(permEngine(x.size), x)
     return dells
 
 def permIt(x):
     """ Takes an nx1 bector x as input and computes the PermII
         value of that vector.
     """
-    n = x.size
-    v = 0
-    for k in range(1,n+1):
-        v_j = 0
-        for j in range(1,n+1):
-            v_j += (j+10) * (x[j-1]**k -(1/(j**k)))
-        v += v_j**2
-    return v
+    return permVal(x)
 
 ########################################################################
 ##################### Main Method ######################################
@@ -187,7 +132,6 @@ if __name__ == '__main__':
     v,g = f(x)
     y,z = myArmijo(x,-g,4,0.1,f)
     opt,val,n = mySteep(x,t,f)
-    Q_i = np.invert(Q)
-    topt = np.matmul(Q_i,b)
+    topt = la.solve(Q,b) # Solve instead of forming Q^-1
     print(abs(opt-topt))
     
\ No newline at end of file
@@ -4,6 +4,8 @@
 
 import numpy as np
 from numpy import linalg as la
+from quadUtil import QuadObjective
+from permII import permEngine
 
 def randQuad(n):
     """ Takes an integer n as input and returns an nxn matrix, Q,
@@ -20,43 +22,18 @@ def myQuad(x,Q,b):
         the function f(x) = 0.5*x^T*Q*x - b^T*x and g is the gradient
         of f at x.
     """
-    #Make sure the input is numpy compatible
-    x = np.array(x)
-    Q = np.array(Q)
-    b = np.array(b)
-    # Run f(x)
-    r = 0.5 * np.matmul(x.transpose(), np.matmul(Q, x)) - np.matmul(b.transpose(), x)
-    # Since we're hoping for a symmetric, positive definite Q, I'm taking
-    # the shortcut to the gradient where d/dx[x^TAx] = 2Ax if A is symmetric
-    # and positive definite.
-    g = np.matmul(Q,x) - b
-    return r,g
+    # Thin wrapper, QuadObjective does the work without copying Q. If
+    # you're calling this in a loop build a QuadObjective once instead.
+    return QuadObjective(Q,b)(x)
 
 def myPerm(x):
     """ Takes the nx1 vector x as input and returns r,g where r is the value
         of the PermII function evaluated at x and g is the gradient of the
         PermII function at x.
     """
-    # Generate output
-    r = 0
-    g = np.zeros(x.shape)
-    n = x.size
-    # Loop the function and compute
-    for i in range(1,n+1):
-        r_i = 0
-        g_i = np.zeros(x.shape)
-        for j in range(1,n+1):
-            # Inner sum that gets squared before adding to outer sum
-            r_i += (j + 10)*(x[j-1]**i - (1/(j**i)))
-        #g[i-1] = 2*r_i + (i+10)*i*(x[i-1]**i-1)
-        g_i[:] = 2*r_i
-        r += r_i**2
-        for l in range(1,n+1):
-            #Add the inside part of the chain rule expression
-            g_i[l-1] = g_i[l-1]*(10 + l)*(i * x[l-1]**(i-1))
-        g += g_i
-            
-    return r,g
+    # The weights and j^-i table get built once per dimension, after that
+    # it's just a power table and a few array ops (see permII.py)
+    return permEngine(np.size(x))(x)
 
 def myArmijo(x,p,a,r,f):
     """ An implementation of Armijo line search with c=1e-4
@@ -131,7 +108,6 @@ if __name__ == '__main__':
     v,g = f(x)
     y,z = myArmijo(x,-g,4,0.1,f)
     opt,val,n = mySteep(x,t,f)
-    Q_i = la.inv(Q)
-    topt = np.matmul(Q_i,b)
+    topt = la.solve(Q,b) # Solve instead of forming Q^-1
     print(abs(opt-topt))
     
\ No newline at end of file
@@ -2,17 +2,34 @@
 # 1/13/21
 # M/CS 435
 
+import time
 import numpy as np
 from numpy import linalg as la
+from quadUtil import QuadObjective, dot64, norm64
+from quadSolve import myQuadMin
+from optTrace import TimedObjective
+from optCheck import Checkpoint
+from optOptions import SolverOptions
+from permII import permEngine
+try:
+    from scipy.linalg import blas
+except ImportError:
+    blas = None
 
-def randQuad(n):
+def randQuad(n, dtype=np.float64):
     """ Takes an integer n as input and returns an nxn matrix, Q,
-        and an nx1 vector, b. Q and b are randomly generated.
+        and an nx1 vector, b. Q and b are randomly generated, then
+        stored as dtype (same draws whatever the dtype).
     """
     A = np.random.rand(n,n)
     b = np.random.rand(n,1)
     Q = np.matmul(A.transpose(), A)
-    return Q,b
+    return Q.astype(dtype, copy=False), b.astype(dtype, copy=False)
+
+def quadType(Q):
+    """ float32 if Q is stored that way, float64 for everything else.
+    """
+    return np.float32 if getattr(Q, 'dtype', None) == np.float32 else np.float64
 
 def myQuad(x,Q,b):
     """ Takes an nx1 vector x, an nxn matrix Q, and an nx1 vector
@@ -20,163 +37,597 @@ def myQuad(x,Q,b):
         the function f(x) = 0.5*x^T*Q*x - b^T*x and g is the gradient
         of f at x.
     """
-    #Make sure the input is numpy compatible
-    x = np.array(x)
-    Q = np.array(Q)
-    b = np.array(b)
-    # Run f(x)
-    r = 0.5 * np.matmul(x.transpose(), np.matmul(Q, x)) - np.matmul(b.transpose(), x)
-    # Since we're hoping for a symmetric, positive definite Q, I'm taking
-    # the shortcut to the gradient where d/dx[x^TAx] = 2Ax if A is symmetric
-    # and positive definite.
-    g = np.matmul(Q,x) - b
-    return r,g
+    # Thin wrapper, QuadObjective does the work without copying Q. If
+    # you're calling this in a loop build a QuadObjective once instead.
+    return QuadObjective(Q,b,quadType(Q))(x)
 
 def myPerm(x):
     """ Takes the nx1 vector x as input and returns r,g where r is the value
         of the PermII function evaluated at x and g is the gradient of the
         PermII function at x.
     """
-    # Generate output
-    r = 0
-    g = np.zeros(x.shape)
-    n = x.size
-    # Loop the function and compute
-    for i in range(1,n+1):
-        r_i = 0
-        g_i = np.zeros(x.shape)
-        for j in range(1,n+1):
-            # Inner sum that gets squared before adding to outer sum
-            r_i += (j + 10)*(x[j-1]**i - (1/(j**i)))
-        #g[i-1] = 2*r_i + (i+10)*i*(x[i-1]**i-1)
-        g_i[:] = 2*r_i
-        r += r_i**2
-        for l in range(1,n+1):
-            #Add the inside part of the chain rule expression
-            g_i[l-1] = g_i[l-1]*(10 + l)*(i * x[l-1]**(i-1))
-        g += g_i
-            
-    return r,g
-
-def myArmijo(x,p,a,r,f):
-    """ An implementation of Armijo line search with c=1e-4
+    # The weights and j^-i table get built once per dimension, after that
+    # it's just a power table and a few array ops (see permII.py)
+    return permEngine(np.size(x))(x)
+
+def myQuadBatch(X,Q,b):
+    """ Batch version of myQuad. Takes an nxm block X whose columns are
+        points, an nxn matrix Q, and an nx1 vector b, and returns r and g,
+        where r is the m-vector of f values and g is the nxm matrix of
+        gradients. One Q*X product covers every column at once.
+    """
+    return QuadObjective(Q,b,quadType(Q)).batch(X)
+
+def myPermBatch(X):
+    """ Batch version of myPerm. Takes an nxm block X of points and returns
+        the m-vector of PermII values and the nxm matrix of gradients.
+    """
+    return permEngine(np.shape(X)[0]).batch(X)
+
+def batched(f, fb):
+    """ Tags the objective f with its batch form fb so the line search and
+        optimizers know they can hand it an nxm block of points.
+        fb(X) has to return (m-vector of values, nxm gradients).
+    """
+    f.batch = fb
+    return f
+
+def mySearch(x,p,a,r,f,f_k,g_k,wolfe=False,c=1e-4,gamma=0.95,nb=4):
+    """ Armijo backtracking that starts from what the caller
+        already knows about x instead of evaluating it again.
         Input: x- current point, p- descent direction, a- largest step size,
-                r- reduction factor, f- function being minimized
-        Output: alfa- calculated step size, n- number of calls to f
+                r- reduction factor, f- function being minimized,
+                f_k, g_k- the value and gradient of f at x,
+                wolfe- also demand the curvature condition, off by default
+                since backtracking only shrinks the step and can't fix a
+                step that's too short (use myWolfe for that),
+                c- sufficient decrease constant, gamma- curvature constant,
+                nb- trial steps per batch call once the first trial (which
+                goes alone, it's usually the one that gets taken) fails
+        Output: alfa- calculated step size, n- number of points f was
+                evaluated at, f_k1, g_k1- value and gradient at x + alfa*p,
+                shaped like f_k and g_k whichever way they were evaluated
+        If f carries a batch form (see batched) the trial steps get
+        evaluated a block at a time instead of one call per step.
+        Close to the minimum the decrease can drop below what f can
+        resolve, so a step is also taken if f stayed within roundoff of f_k
+        and the slope along p is still well short of turning up (the
+        approximate Armijo test of Hager & Zhang). Steps that don't move x
+        at all never count.
     """
-    # Establish constants and output
-    c = 1e-4
+    # Establish constants and output, c < gamma < 1 has to hold
     alfa = a
-    gamma = 0.95 # c < gamma < 1 has to hold
+    amin = a * 1e-30 # r*alfa stops shrinking down in the subnormals
     n = 0
-    f_k,g_k = f(x)
-    n+= 1
-    f_k1,g_k1 = f(x + (a*p))
-    ex = f_k + c*a*np.transpose(g_k)*p
-    ct = gamma * abs(np.matmul(np.transpose(g_k),p))
-    n+= 1
-    curve = abs(np.matmul(np.transpose(g_k1),p)) <= ct
-    while alfa > 0:
-        if f_k1.all()<=ex.all() & curve:
-            return alfa, n
+    f_0 = np.asarray(f_k).item()
+    slope = dot64(g_k, p) # g_k^T*p, negative for a descent direction
+    ct = gamma * abs(slope) if wolfe else np.inf
+    #Roundoff in f (1e-6*|f|, their choice, f is a difference of big terms
+    #near the minimum so it's a lot noisier than eps*|f|) and the slope cap
+    #for the approximate test
+    fEps = max(1e-6, 100*np.finfo(np.asarray(p).dtype).eps) * abs(f_0)
+    dMax = 0.8 * abs(slope)
+    fb = getattr(f, 'batch', None)
+    if fb is not None:
+        xc = np.reshape(x, (-1,1))
+        pc = np.reshape(p, (-1,1))
+        k = 1 # Just the first trial, batch the backtracks if it fails
+        while alfa > amin:
+            steps = alfa * r**np.arange(k)
+            k = nb
+            if pc.dtype == np.float32:
+                #Keep the trial block in float32 instead of promoting it
+                steps = steps.astype(np.float32)
+            X_t = xc + pc*steps
+            f_t,g_t = fb(X_t)
+            n+= len(steps)
+            if g_t.dtype == np.float64:
+                d_t = np.matmul(np.ravel(p), g_t)
+            else:
+                d_t = np.einsum('i,ij->j', np.ravel(p), g_t, dtype=np.float64)
+            curve = abs(d_t) <= ct
+            armijo = (f_t <= f_0 + c*steps*slope) | ((f_t <= f_0 + fEps) & (d_t <= dMax))
+            ok = armijo & curve & (X_t != xc).any(axis=0)
+            if ok.any():
+                j = np.argmax(ok)
+                #A contiguous copy, a strided view of g_t would round
+                #differently in h_k*grad than the same gradient after a
+                #checkpoint round trip
+                return steps[j], n, np.reshape(f_t[j], np.shape(f_k)), \
+                       np.ascontiguousarray(g_t[:,j].reshape(np.shape(g_k)))
+            alfa = steps[-1] * r
+        raise Exception("Line search failure!")
+    while alfa > amin:
+        x_t = x + (alfa*p)
+        f_k1,g_k1 = f(x_t)
+        n+= 1
+        d_k1 = dot64(g_k1, p)
+        f_t = np.asarray(f_k1).item()
+        armijo = (f_t <= f_0 + c*alfa*slope) or (f_t <= f_0 + fEps and d_k1 <= dMax)
+        if armijo and abs(d_k1) <= ct and np.any(x_t != x):
+            return alfa, n, f_k1, np.ascontiguousarray(g_k1)
         alfa *= r
-        f_k1,g_k1 = f(x + (alfa*p))
-        curve = abs(np.matmul(np.transpose(g_k1),p)) <= ct
-        ex = (f_k + c*alfa*np.transpose(g_k)*p)
+    raise Exception("Line search failure!")
+
+def myCubic(a_lo,a_hi,f_lo,f_hi,d_lo,d_hi):
+    """ Minimizer of the cubic that matches the values f_lo, f_hi and slopes
+        d_lo, d_hi at a_lo and a_hi. Falls back on the quadratic through
+        f_lo, d_lo and f_hi when the cubic has no real minimizer, and on
+        bisection when neither lands safely inside the interval.
+    """
+    lo, hi = min(a_lo, a_hi), max(a_lo, a_hi)
+    pad = 0.1 * (hi - lo) # Keep trials away from the ends of the bracket
+    t = np.nan
+    d1 = d_lo + d_hi - 3*(f_lo - f_hi)/(a_lo - a_hi)
+    rad = d1*d1 - d_lo*d_hi
+    if rad >= 0:
+        d2 = np.sign(a_hi - a_lo) * np.sqrt(rad)
+        den = d_hi - d_lo + 2*d2
+        if den != 0:
+            t = a_hi - (a_hi - a_lo)*(d_hi + d2 - d1)/den
+    if not (lo + pad <= t <= hi - pad):
+        da = a_hi - a_lo
+        den = 2*(f_hi - f_lo - d_lo*da)
+        t = a_lo - d_lo*da*da/den if den > 0 else np.nan
+    if not (lo + pad <= t <= hi - pad):
+        t = 0.5*(lo + hi)
+    return t
+
+def myWolfe(x,p,a,f,f_k,g_k,c1=1e-4,c2=0.9):
+    """ Strong Wolfe line search, the bracketing phase followed by zoom
+        with safeguarded cubic interpolation (Nocedal & Wright alg. 3.5/3.6).
+        Input: x- current point, p- descent direction, a- first trial step,
+                f- function being minimized, f_k, g_k- value and gradient
+                of f at x, c1, c2- sufficient decrease and curvature constants
+        Output: alfa- calculated step size, n- number of calls to f,
+                f_k1, g_k1- value and gradient at x + alfa*p
+        Sufficient decrease takes the same roundoff fallback as mySearch,
+        and if no trial meets the curvature condition it settles for the
+        lowest trial that gave sufficient decrease before giving up.
+    """
+    its = 30 # Cap on evaluations for bracketing and for zoom
+    f_0 = np.asarray(f_k).item()
+    d_0 = dot64(g_k, p)
+    if d_0 >= 0:
+        raise Exception("Line search failure! p isn't a descent direction")
+    #Roundoff in f and the slope cap, see mySearch
+    fEps = max(1e-6, 100*np.finfo(np.asarray(p).dtype).eps) * abs(f_0)
+    dMax = 0.8 * abs(d_0)
+    best = None # Lowest (alfa, f, fg) with sufficient decrease so far
+    n = 0
+    def trial(alfa):
+        # f at x + alfa*p, plus whether it counts as sufficient decrease
+        nonlocal best
+        x_t = x + alfa*p
+        fg = f(x_t)
+        f_a = np.asarray(fg[0]).item()
+        d_a = dot64(fg[1], p)
+        ok = (f_a <= f_0 + c1*alfa*d_0) or (f_a <= f_0 + fEps and d_a <= dMax)
+        ok = ok and np.any(x_t != x)
+        if ok and (best is None or f_a < best[1]):
+            best = (alfa, f_a, fg)
+        return fg, f_a, d_a, ok
+    #Bracketing, grow the step until the interval has to hold a Wolfe point
+    a_prev, f_prev, d_prev = 0, f_0, d_0
+    fg_prev = None
+    alfa = a
+    for i in range(its):
+        fg, f_a, d_a, ok = trial(alfa)
+        n+= 1
+        if (not ok) or (i > 0 and f_a >= f_prev):
+            lo, hi = (a_prev, f_prev, d_prev, fg_prev), (alfa, f_a, d_a, fg)
+            break
+        if abs(d_a) <= -c2*d_0:
+            return alfa, n, fg[0], np.ascontiguousarray(fg[1])
+        if d_a >= 0:
+            lo, hi = (alfa, f_a, d_a, fg), (a_prev, f_prev, d_prev, fg_prev)
+            break
+        a_prev, f_prev, d_prev, fg_prev = alfa, f_a, d_a, fg
+        alfa = 2*alfa
+    else:
+        lo = None
+    #Zoom, lo always satisfies sufficient decrease and has the lower value
+    for i in range(its if lo is not None else 0):
+        alfa = myCubic(lo[0], hi[0], lo[1], hi[1], lo[2], hi[2])
+        fg, f_a, d_a, ok = trial(alfa)
         n+= 1
+        if (not ok) or (f_a >= lo[1]):
+            hi = (alfa, f_a, d_a, fg)
+        else:
+            if abs(d_a) <= -c2*d_0:
+                return alfa, n, fg[0], np.ascontiguousarray(fg[1])
+            if d_a*(hi[0] - lo[0]) >= 0:
+                hi = lo
+            lo = (alfa, f_a, d_a, fg)
+    if best is not None:
+        #Out of patience, take the best point that still gave decrease
+        return best[0], n, best[2][0], np.ascontiguousarray(best[2][1])
     raise Exception("Line search failure!")
+
+def myArmijo(x,p,a,r,f,wolfe=False):
+    """ An implementation of Armijo line search with c=1e-4
+        Input: x- current point, p- descent direction, a- largest step size,
+                r- reduction factor, f- function being minimized,
+                wolfe- also demand the curvature condition (gamma=0.95)
+        Output: alfa- calculated step size, n- number of calls to f
+        Evaluates f at x first, if you already have f(x) use mySearch.
+    """
+    f_k,g_k = f(x)
+    alfa,n,_,_ = mySearch(x,p,a,r,f,f_k,g_k,wolfe)
+    return alfa, n+1
     
-def mySteep(x, tol, f):
+def myLine(x,p,a,r,f,f_k,g_k,ls,opts,wolfe=False):
+    """ Runs the line search ls asks for ('armijo' or 'wolfe') with the
+        settings in opts and returns what it does. In float32 a failed
+        search just means f can't resolve any more decrease at that
+        precision, so it hands back None instead of raising and the
+        optimizer stops there with stats['stalled'] set.
+    """
+    try:
+        if ls == 'wolfe':
+            return myWolfe(x,p,a,f,f_k,g_k,opts.c1,opts.c2)
+        return mySearch(x,p,a,r,f,f_k,g_k,wolfe,opts.c,opts.gamma,opts.nb)
+    except Exception:
+        if np.asarray(x).dtype != np.float32:
+            raise
+        return None
+
+def myCount(f, n, m0):
+    """ The call count an optimizer should report. For a CachedObjective
+        that's the number of unique points actually evaluated since it
+        started (misses went from m0 up), otherwise just n.
+    """
+    if m0 is None:
+        return n
+    return f.misses - m0
+
+def myTrace(callback, f, i, alfa, n, grad, val, t0):
+    """ Hands iteration i to the callback (see optTrace.py) with the time
+        f spent in the objective since the last call split off from the
+        rest, and returns the new start time for the next iteration.
+    """
+    t1 = time.perf_counter()
+    tObj = f.take()
+    callback(i, alfa, n, norm64(grad), np.asarray(val).item(), tObj, t1-t0-tObj)
+    return t1
+
+def myRestore(ckpt, f, m0):
+    """ Pulls a loaded snapshot off ckpt (None if there isn't one, or no
+        ckpt). When f is a CachedObjective m0 gets moved back so the call
+        count keeps going from where the snapshot left it.
+        Output: st- the snapshot or None, m0- the adjusted start count
+    """
+    st = ckpt.take() if ckpt is not None else None
+    if st is not None and m0 is not None:
+        m0 = f.misses - int(st['nc'])
+    return st, m0
+
+def mySteep(x, tol, f, ls='armijo', stats=None, callback=None, ckpt=None,
+            opts=None):
     """ Implements the steepest descent algorithm using
         Armijo line search.
         Inputs: x- the point to be evaluated, tol- tolerance,
-                f- the function to be minimized
+                f- the function to be minimized, optionally tagged
+                with a batch form by batched(),
+                ls- 'armijo' for backtracking or 'wolfe' for myWolfe,
+                stats- optional dict, gets the iteration count as 'its',
+                callback- called every iteration, see optTrace.py,
+                ckpt- optional Checkpoint, see optCheck.py,
+                opts- SolverOptions with the iteration cap and line search
+                settings, see optOptions.py
         Output: opt- the approximate optimum, val- the function value at opt
                 n- the number of function calls to f
     """
     # Declare output
-    val = np.inf
-    n = 1 # Start at 1 since we'll call the function at least once
-    opt = x
-    its = 1000 # Adjustable constant for max number of iterations
-    r = 0.25 # Used in myArmijo, tune for optimality
-    a = 4   # Another tunable for getting more efficient search
-    for i in range(its):
+    opts = SolverOptions() if opts is None else opts
+    opt = x if opts.dtype is None else np.asarray(x, dtype=opts.dtype)
+    its = opts.its # Max number of iterations
+    r = opts.pick('r', 0.25) # Used in mySearch
+    a = opts.pick('a', 4)   # First trial step
+    alfa = oSlope = 0.0 # Carried between iterations by the wolfe guess
+    i0 = 0
+    m0 = getattr(f, 'misses', None) # Only a CachedObjective has this
+    st, m0 = myRestore(ckpt, f, m0)
+    if callback is not None:
+        f = TimedObjective(f)
+    if st is None:
         val,grad = f(opt)
-        if la.norm(grad) < tol:
-            return opt, val, n
+        n = 1 # Every other evaluation happens inside mySearch
+    else:
+        opt, val, grad = st['opt'], st['val'], st['grad']
+        n, i0 = int(st['n']), int(st['i'])
+        a, alfa, oSlope = float(st['a']), float(st['alfa']), float(st['oSlope'])
+    if callback is not None:
+        f.take()
+        t0 = time.perf_counter()
+    for i in range(i0, its):
+        if norm64(grad) < tol:
+            if stats is not None:
+                stats['its'] = i
+            return opt, val, myCount(f, n, m0)
         p = -grad
-        alfa,n_i = myArmijo(opt,p,a,r,f)
-        opt += alfa*p
-        n += 1+n_i
+        if ls == 'wolfe':
+            #First guess assumes the same first order change as last step
+            slope = dot64(grad, p)
+            if i > 0:
+                a = alfa * oSlope / slope
+            oSlope = slope
+        found = myLine(opt,p,a,r,f,val,grad,ls,opts)
+        if found is None:
+            #float32 ran out of resolution, this is as close as it gets
+            if stats is not None:
+                stats['its'] = i
+                stats['stalled'] = True
+            return opt, val, myCount(f, n, m0)
+        alfa,n_i,val,grad = found
+        alfa = float(alfa) # A numpy float64 would drag float32 x up with it
+        opt = opt + alfa*p
+        n += n_i
+        if callback is not None:
+            t0 = myTrace(callback, f, i, alfa, myCount(f, n, m0), grad, val, t0)
+        if ckpt is not None and ckpt.due(i):
+            ckpt.save(method='steep', tol=tol, ls=ls, i=i+1, opt=opt, val=val,
+                      grad=grad, n=n, nc=myCount(f, n, m0), a=a, alfa=alfa,
+                      oSlope=oSlope, opts=opts.toJSON())
     
-    return opt, val, n
+    if stats is not None:
+        stats['its'] = its
+    return opt, val, myCount(f, n, m0)
 
-def myBFGS(x, tol, f):
+def myBFGS(x, tol, f, mem=0, sym=False, ls='armijo', stats=None,
+           callback=None, ckpt=None, opts=None):
     """ Implements the BFGS algorithm using
         Armijo line search.
         Inputs: x- the point to be evaluated, tol- tolerance,
-                f- the function to be minimized
+                f- the function to be minimized, optionally tagged
+                with a batch form by batched(),
+                mem- history length, anything > 0 switches to myLBFGS,
+                sym- keep only the upper triangle of h_k (needs scipy),
+                the dense h_k is n x n, so for big sparse or matrix-free
+                problems use mem > 0 to keep everything O(n),
+                ls- 'armijo' for backtracking or 'wolfe' for myWolfe,
+                stats- optional dict, gets the iteration count as 'its',
+                callback- called every iteration, see optTrace.py,
+                ckpt- optional Checkpoint, see optCheck.py,
+                opts- SolverOptions with the iteration cap and line search
+                settings, see optOptions.py
         Output: opt- the approximate optimum, val- the function value at opt
                 n- the number of function calls to f
     """
+    if mem > 0:
+        return myLBFGS(x, tol, f, mem, ls, stats, callback, ckpt, opts)
     ##Output declaration
-    opt = x
+    opts = SolverOptions() if opts is None else opts
+    opt = x if opts.dtype is None else np.asarray(x, dtype=opts.dtype)
     val = np.inf
-    n = 2 #We're guaranteed to call f at least twice
-    its = 1000 #Max iterations, make it bigger if you want
+    n = 1 #The start point, everything else gets counted by mySearch
+    its = opts.its #Max iterations
     
     ##Adding constants
-    h_k = np.eye(np.shape(x)[0]) #read col. dims from x, make h_0 = I_x
-    r = 0.85 # Used in myArmijo, tune for optimality
-    a = 1# Another tunable for getting more efficient search
+    #h_0 = I, Fortran ordered so BLAS can update it in place. It's
+    #float32 when x is, which halves the O(n^2) traffic per update
+    hType = np.float32 if np.asarray(opt).dtype == np.float32 else np.float64
+    h_k = np.eye(np.size(x), dtype=hType, order='F')
+    sym = sym and blas is not None
+    r = opts.pick('r', 0.85) # Used in mySearch
+    a = opts.pick('a', 1) # First trial step
     
     #Time to iterate the loop
-    val, grad = f(opt)
-    for i in range(its):
-        if la.norm(grad) <= tol:
-##            print("Step: ", i) #Uncomment to see how many iterations in execution
-            return opt, val, n
-        pk = -np.dot(h_k, grad)
-        
-        #Do that line search
-        alfa, n_i = myArmijo(opt,pk,a,r,f)
-        dx = (opt+alfa*pk)-opt
-
-        opt = opt + alfa*pk #update x_k+1
+    i0 = 0
+    m0 = getattr(f, 'misses', None) # Only a CachedObjective has this
+    st, m0 = myRestore(ckpt, f, m0)
+    if callback is not None:
+        f = TimedObjective(f)
+    if st is None:
+        val, grad = f(opt)
+    else:
+        opt, val, grad = st['opt'], st['val'], st['grad']
+        n, i0 = int(st['n']), int(st['i'])
+        h_k = np.asfortranarray(st['h_k'])
+    if blas is not None:
+        symv, syr2, ger = blas.get_blas_funcs(('symv', 'syr2', 'ger'), (h_k,))
+    if callback is not None:
+        f.take()
+        t0 = time.perf_counter()
+    for i in range(i0, its):
+        if norm64(grad) <= tol:
+            if stats is not None:
+                stats['its'] = i
+            return opt, val, myCount(f, n, m0)
+        if sym:
+            pk = symv(-1.0, h_k, np.ravel(grad)).reshape(np.shape(grad))
+        else:
+            pk = -np.dot(h_k, grad)
         
-        dxt = dx.transpose()
-        nVal, nGrad = f(opt)
-        if nVal > val:
-            opt = opt - 0.5*alfa*pk
-            nVal, nGrad = f(opt)
-        dg = nGrad - grad
-        dgt = dg.transpose()
+        #Do that line search, it hands back f and its gradient at x_k+1
+        found = myLine(opt,pk,a,r,f,val,grad,ls,opts)
+        if found is None:
+            #float32 ran out of resolution, this is as close as it gets
+            if stats is not None:
+                stats['its'] = i
+                stats['stalled'] = True
+            return opt, val, myCount(f, n, m0)
+        alfa, n_i, nVal, nGrad = found
+        alfa = float(alfa)
+        nOpt = opt + alfa*pk #update x_k+1
+        dx = np.ravel(nOpt - opt)
+        dg = np.ravel(nGrad - grad)
+        opt = nOpt
         
-        #Now the fancy bit
-        denom1 = np.dot(dgt, dx)[0,0] #indexed to extract raw float
-        if denom1 != 0:
-            denom1 = 1/denom1
-        denom2 = np.dot(dxt, dg)[0,0] #same as denom1
-        if denom2 != 0:
-            denom2 = 1/denom2
-        if (denom1==0) & (denom2==0):#had some issues with this debugging
-            print(dx) #So it stayed in as error-proofing
-            print(dg)
-            raise Exception("Change not possible! H_{k+1} == H_k")
-        sca = 1 + np.dot(dgt, np.dot(h_k, dg)) * denom1
-        mat1 = sca * np.dot(dx,dxt) * denom2
-        mat2 = np.matmul(h_k, np.dot(dg,dxt))
-        mat2 = mat2 + mat2.transpose()
-        mat2 = mat2* denom2
-        h_k = h_k + (mat1 - mat2)
+        #Now the fancy bit. Skip the update if the curvature along the
+        #step isn't positive (Armijo doesn't promise it), same as myLBFGS,
+        #otherwise h_k goes indefinite and the next direction goes uphill
+        denom = float(dot64(dg, dx))
+        if denom > 0:
+            denom = 1/denom
+            #H_k+1 = H_k + rho*(c*dx*dx^T - u*dx^T - dx*u^T) with u = H_k*dg
+            #and c = 1 + rho*dg^T*u. Folding it into v = c/2*dx - u makes it
+            #the symmetric rank two update rho*(v*dx^T + dx*v^T), so one
+            #matrix-vector product and an O(n^2) update instead of a matmul.
+            u = symv(1.0, h_k, dg) if sym else np.dot(h_k, dg)
+            v = 0.5*(1 + float(dot64(dg, u))*denom)*dx - u
+            if sym:
+                syr2(denom, v, dx, a=h_k, overwrite_a=1)
+            elif blas is not None:
+                ger(denom, v, dx, a=h_k, overwrite_a=1)
+                ger(denom, dx, v, a=h_k, overwrite_a=1)
+            else:
+                h_k += np.outer(denom*v, dx)
+                h_k += np.outer(dx, denom*v)
         
         #Book-keeping
-        n += 1+n_i
+        n += n_i
+        grad = nGrad
+        val = nVal
+        if callback is not None:
+            t0 = myTrace(callback, f, i, alfa, myCount(f, n, m0), grad, val, t0)
+        if ckpt is not None and ckpt.due(i):
+            ckpt.save(method='bfgs', tol=tol, ls=ls, sym=sym, i=i+1, opt=opt,
+                      val=val, grad=grad, n=n, nc=myCount(f, n, m0), h_k=h_k,
+                      opts=opts.toJSON())
+    if stats is not None:
+        stats['its'] = its
+    return opt, val, myCount(f, n, m0)
+
+
+def myLBFGS(x, tol, f, m=10, ls='armijo', stats=None, callback=None,
+            ckpt=None, opts=None):
+    """ Implements the limited memory BFGS algorithm using
+        Armijo line search. Instead of a dense n x n inverse Hessian it
+        keeps the last m (s,y) pairs in a ring buffer and applies them
+        with the two-loop recursion, so memory is O(m*n).
+        Inputs: x- the point to be evaluated, tol- tolerance,
+                f- the function to be minimized, m- history length,
+                ls- 'armijo' for backtracking or 'wolfe' for myWolfe,
+                stats- optional dict, gets the iteration count as 'its',
+                callback- called every iteration, see optTrace.py,
+                ckpt- optional Checkpoint, see optCheck.py,
+                opts- SolverOptions with the iteration cap and line search
+                settings, see optOptions.py
+        Output: opt- the approximate optimum, val- the function value at opt
+                n- the number of function calls to f
+    """
+    ##Output declaration
+    opts = SolverOptions() if opts is None else opts
+    opt = x if opts.dtype is None else np.asarray(x, dtype=opts.dtype)
+    val = np.inf
+    n = 1 #Same accounting as myBFGS
+    its = opts.its #Max iterations
+
+    ##Adding constants
+    r = opts.pick('r', 0.85) # Used in mySearch
+    a = opts.pick('a', 1) # First trial step
+    dim = np.size(x)
+    hType = np.float32 if np.asarray(opt).dtype == np.float32 else np.float64
+    S = np.zeros((m, dim), dtype=hType) # Ring buffer of steps s_k = x_k+1 - x_k
+    Y = np.zeros((m, dim), dtype=hType) # Ring buffer of y_k = g_k+1 - g_k
+    rho = np.zeros(m)      # 1/(y_k^T*s_k)
+    al = np.zeros(m)
+    k = 0 # Number of pairs stored so far, k % m is the next slot
+
+    i0 = 0
+    m0 = getattr(f, 'misses', None) # Only a CachedObjective has this
+    st, m0 = myRestore(ckpt, f, m0)
+    if callback is not None:
+        f = TimedObjective(f)
+    if st is None:
+        val, grad = f(opt)
+    else:
+        opt, val, grad = st['opt'], st['val'], st['grad']
+        n, i0, k = int(st['n']), int(st['i']), int(st['k'])
+        S, Y, rho = st['S'], st['Y'], st['rho']
+    if callback is not None:
+        f.take()
+        t0 = time.perf_counter()
+    for i in range(i0, its):
+        if norm64(grad) <= tol:
+            if stats is not None:
+                stats['its'] = i
+            return opt, val, myCount(f, n, m0)
+        #Two-loop recursion, newest pair first on the way down
+        q = -np.ravel(grad)
+        order = [(k-1-j) % m for j in range(min(k, m))]
+        for j in order:
+            al[j] = rho[j] * dot64(S[j], q)
+            q -= al[j] * Y[j]
+        if k > 0:
+            #Scale H_0 = (s^T*y / y^T*y)*I off the newest pair
+            q *= 1 / (rho[order[0]] * dot64(Y[order[0]], Y[order[0]]))
+        for j in reversed(order):
+            q += (al[j] - rho[j] * dot64(Y[j], q)) * S[j]
+        pk = q.reshape(np.shape(grad))
+
+        #Do that line search
+        found = myLine(opt,pk,a,r,f,val,grad,ls,opts)
+        if found is None:
+            #float32 ran out of resolution, this is as close as it gets
+            if stats is not None:
+                stats['its'] = i
+                stats['stalled'] = True
+            return opt, val, myCount(f, n, m0)
+        alfa, n_i, nVal, nGrad = found
+        alfa = float(alfa)
+        opt = opt + alfa*pk #update x_k+1
+
+        #Store the new pair, skipping it if it would lose positive definiteness
+        s_k = alfa * q
+        y_k = np.ravel(nGrad) - np.ravel(grad)
+        sy = dot64(s_k, y_k)
+        if sy > 0:
+            S[k % m] = s_k
+            Y[k % m] = y_k
+            rho[k % m] = 1 / sy
+            k += 1
+
+        #Book-keeping
+        n += n_i
         grad = nGrad
         val = nVal
-    return opt, val, n
+        if callback is not None:
+            t0 = myTrace(callback, f, i, alfa, myCount(f, n, m0), grad, val, t0)
+        if ckpt is not None and ckpt.due(i):
+            ckpt.save(method='lbfgs', tol=tol, ls=ls, m=m, i=i+1, opt=opt,
+                      val=val, grad=grad, n=n, nc=myCount(f, n, m0), k=k,
+                      S=S, Y=Y, rho=rho, opts=opts.toJSON())
+    if stats is not None:
+        stats['its'] = its
+    return opt, val, myCount(f, n, m0)
+
+def myResume(path, f, stats=None, callback=None, every=None):
+    """ Picks up a run from the checkpoint at path and finishes it with the
+        same solver and settings it was started with, saving to the same
+        file as it goes (every iterations, default whatever the run used).
+        f has to be the same objective the run started on.
+        Output: opt- the approximate optimum, val- the function value at opt
+                n- the number of function calls to f, counting the ones
+                made before the checkpoint
+    """
+    ckpt = Checkpoint(path)
+    st = ckpt.load()
+    ckpt.every = int(st['every']) if every is None else every
+    method, tol, ls = str(st['method']), float(st['tol']), str(st['ls'])
+    opts = SolverOptions.fromJSON(str(st['opts']))
+    if method == 'steep':
+        return mySteep(st['opt'], tol, f, ls, stats, callback, ckpt, opts)
+    if method == 'bfgs':
+        return myBFGS(st['opt'], tol, f, sym=bool(st['sym']), ls=ls,
+                      stats=stats, callback=callback, ckpt=ckpt, opts=opts)
+    if method == 'lbfgs':
+        return myLBFGS(st['opt'], tol, f, int(st['m']), ls, stats, callback,
+                       ckpt, opts)
+    raise Exception("Unknown checkpoint method: " + method)
 
+def myMin(x, tol, f, stats=None, **kw):
+    """ Minimizes f with the best fit we've got: a known quadratic (a
+        QuadObjective, or a wrapper that hands out its Q and b) goes to
+        the direct/CG solvers in quadSolve, everything else goes to myBFGS
+        with any extra keywords.
+        Output: opt- the approximate optimum, val- the function value at opt
+                n- the number of function calls to f
+    """
+    if isinstance(f, QuadObjective) or (hasattr(f, 'Q') and hasattr(f, 'b')):
+        return myQuadMin(x, tol, f, stats)
+    return myBFGS(x, tol, f, stats=stats, **kw)
     
 ########################################################################
 ##################### Main Method ######################################
@@ -191,7 +642,7 @@ if __name__ == '__main__':
     t = 1e-4
     x = np.random.rand(n,1)+10
     Q,b = randQuad(n)
-    f = lambda j:myQuad(j,Q,b)
+    f = QuadObjective(Q,b) # Comes with its own batch form
     v,g = f(x)
     opt,val,count = myBFGS(x,t,f)
     print("Initial value: ", v)
@@ -200,7 +651,7 @@ if __name__ == '__main__':
         print("Checks out")
     print("Function value difference: ", v-val)
     print("X value difference:\n ", x-opt)
-    truMin = np.dot(la.inv(Q), b)
+    truMin = la.solve(Q, b)
     print("Absolute min diff:\n", truMin-opt)
     
     ########################################################################
@@ -211,7 +662,7 @@ if __name__ == '__main__':
     permMin = np.ones((n,1))
     for i in range(np.size(permMin)):
         permMin[i] = 1/ (i+1)
-    per = lambda y:myPerm(y)
+    per = batched(lambda y:myPerm(y), myPermBatch)
     x = np.random.rand(n,1)
     vp,gp = per(x)
     optp, valp, m = myBFGS(x,t,per)
@@ -0,0 +1,124 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Lockstep solvers for stacks of small quadratics. k problems
+# f_k(x) = 0.5*x^T*Q_k*x - b_k^T*x get stacked into (k,n,n) and (k,n)
+# arrays and every iteration is a handful of batched matmuls over the
+# whole stack instead of k trips through mySteep/myBFGS.
+
+import numpy as np
+
+def _bmv(A, X):
+    """ Stacked matrix-vector product, A is (k,n,n) and X is (k,n).
+    """
+    return np.matmul(A, X[:,:,None])[:,:,0]
+
+def _dot(X, Y):
+    """ Row-wise dot products of two (k,n) stacks.
+    """
+    return np.einsum('ki,ki->k', X, Y)
+
+def _steepStep(st, live):
+    """ One steepest descent step on every live problem. The objective
+        is quadratic, so the exact step g^T*g / g^T*Q*g is available and
+        no line search is needed.
+    """
+    G = st['G']
+    QG = _bmv(st['Q'], G)
+    den = _dot(G, QG)
+    alfa = np.divide(_dot(G, G), den, out=np.zeros_like(den), where=live & (den > 0))
+    st['X'] -= alfa[:,None] * G
+    G -= alfa[:,None] * QG
+
+def _bfgsStep(st, live):
+    """ One BFGS step on every live problem with the exact step along p,
+        then the same rank two inverse Hessian update myBFGS uses, applied
+        to the whole (k,n,n) stack.
+    """
+    G, H = st['G'], st['H']
+    P = -_bmv(H, G)
+    QP = _bmv(st['Q'], P)
+    den = _dot(P, QP)
+    alfa = np.divide(-_dot(G, P), den, out=np.zeros_like(den), where=live & (den > 0))
+    S = alfa[:,None] * P
+    Y = alfa[:,None] * QP
+    st['X'] += S
+    G += Y
+    sy = _dot(Y, S)
+    rho = np.divide(1, sy, out=np.zeros_like(sy), where=sy > 0)
+    U = _bmv(H, Y)
+    V = (0.5*(1 + rho*_dot(Y, U)))[:,None] * S - U
+    R = V[:,:,None] * S[:,None,:]
+    R += np.swapaxes(R, 1, 2)
+    H += rho[:,None,None] * R
+
+def _lockstep(X, tol, Q, B, its, step, hess):
+    Q = np.asarray(Q, dtype=np.float64)
+    k,n = Q.shape[0], Q.shape[1]
+    shape = np.shape(B)
+    B = np.asarray(B, dtype=np.float64).reshape(k, n)
+    opt = np.array(X, dtype=np.float64).reshape(k, n)
+    cnt = np.full(k, its + 1)
+    # Packed working set, gets compacted once half of it has converged
+    st = {'idx': np.arange(k), 'Q': Q, 'B': B, 'X': opt.copy()}
+    st['G'] = _bmv(Q, st['X']) - B
+    if hess:
+        st['H'] = np.broadcast_to(np.eye(n), (k,n,n)).copy()
+    live = np.ones(k, dtype=bool)
+    for i in range(its):
+        done = live & (np.sqrt(_dot(st['G'], st['G'])) < tol)
+        if done.any():
+            opt[st['idx'][done]] = st['X'][done]
+            cnt[st['idx'][done]] = i + 1
+            live &= ~done
+            if not live.any():
+                break
+            if 2*live.sum() <= live.size:
+                for key in st:
+                    st[key] = st[key][live]
+                live = live[live]
+        step(st, live)
+    else:
+        opt[st['idx'][live]] = st['X'][live]
+    G = _bmv(Q, opt) - B
+    val = 0.5 * _dot(opt, G - B)
+    return opt.reshape(shape), val, cnt
+
+def batchSteep(X, tol, Q, B, its=1000):
+    """ Steepest descent on k quadratics at once.
+        Inputs: X- (k,n) or (k,n,1) starting points, tol- tolerance on each
+                gradient norm, Q- (k,n,n) stack of SPD matrices, B- (k,n) or
+                (k,n,1) stack of linear terms, its- max iterations
+        Output: opt- the approximate optima shaped like B, val- the k
+                function values, n- products with Q_k each problem took
+    """
+    return _lockstep(X, tol, Q, B, its, _steepStep, False)
+
+def batchBFGS(X, tol, Q, B, its=1000):
+    """ BFGS on k quadratics at once, same inputs and outputs as batchSteep.
+        Keeps a (k,n,n) stack of inverse Hessians, so it's meant for the
+        small problems (n up to a few dozen) this module is for.
+    """
+    return _lockstep(X, tol, Q, B, its, _bfgsStep, True)
+
+
+########################################################################
+##################### Main Method ######################################
+########################################################################
+if __name__ == '__main__':
+
+    import time
+    from numpy import linalg as la
+    k = 2000
+    n = 10
+    A = np.random.rand(k, n, n)
+    Q = np.matmul(np.swapaxes(A, 1, 2), A) + np.eye(n)
+    B = np.random.rand(k, n, 1)
+    X = np.random.rand(k, n, 1)
+    truMin = la.solve(Q, B)
+    for solver in (batchSteep, batchBFGS):
+        t = time.perf_counter()
+        opt,val,cnt = solver(X, 1e-6, Q, B)
+        print(solver.__name__, '{0:.3f}'.format(time.perf_counter() - t), "s for",
+              k, "problems, max error", np.abs(opt - truMin).max(),
+              "mean products", cnt.mean())
@@ -0,0 +1,514 @@
+"""
+Author: Andrew Dunn
+Spec:
+The download engine for bingScrapev3.py. Tiles get fetched on a thread pool
+that shares one pooled requests.Session (so connections get reused instead
+of paying a fresh handshake per request) behind a global token bucket rate
+limit, so we can keep a bunch of requests in flight without making Bing mad.
+Requests that fail get retried with jittered exponential backoff (a 429
+pauses every worker for its Retry-After), and tiles that still fail go into
+a FailureQueue on disk for bingScrapev3.py --retry-failed to drain later.
+TileManifest keeps every planned tile and how it went in SQLite, so a
+restarted run only fetches what's missing or failed.
+Point it at a different lead url (like a local http.server) to test it.
+"""
+import email.utils
+import hashlib
+import json as jsonlib
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class RateLimiter:
+    """
+    Token bucket shared by every thread: rate tokens per second, holding at
+    most burst of them. acquire() blocks until a token is free.
+
+    Input:
+        rate: requests per second allowed overall, None or <= 0 for no limit
+        burst: how many requests can go out back to back after a lull
+    """
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.hold = 0 #No pausing until pause() says so
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate is None or self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Holds every thread off for seconds (used when Bing sends a 429).
+        """
+        with self.lock:
+            self.hold = max(self.hold, time.monotonic() + seconds)
+
+    def wait(self):
+        """
+        Blocks until any pause() has run out, then takes a token.
+        """
+        while True:
+            left = self.hold - time.monotonic()
+            if left <= 0:
+                break
+            time.sleep(left)
+        self.acquire()
+
+
+def makeSession(pool=16):
+    """
+    Builds a requests.Session whose connection pool can hold pool connections
+    per host, so that many worker threads can share it without throwing
+    connections away.
+
+    Input:
+        pool: the number of connections to keep per host
+    Output:
+        session: the requests.Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+#Status codes worth trying again, anything else is taken as the answer
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def backoff(attempt, base=1.0, cap=60.0):
+    """
+    How long to sleep before retry number attempt (counting from 0): a random
+    spot between 0 and base*2^attempt, capped. The jitter keeps the workers
+    from all coming back at the same moment.
+    """
+    return random.uniform(0, min(cap, base * 2**attempt))
+
+
+def retryAfter(response):
+    """
+    The Retry-After header of response in seconds (it can be a number or an
+    HTTP date), None if there isn't a usable one.
+    """
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+class FailureQueue:
+    """
+    Tiles that ran out of retries, one JSON object per line in path. Lines
+    get appended (and fsynced) as the failures happen, so a crash doesn't lose
+    them, and nothing in here needs the shapefile to be fetched again.
+
+    Input:
+        path: the .jsonl file, made on the first failure
+    """
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+
+    def put(self, result):
+        """
+        Appends a fetch() result to the queue.
+        """
+        entry = {'point': list(result['point']), 'handle': result['handle'],
+                 'status': list(result['status']), 'error': result['error'],
+                 'attempts': result['attempts'], 'time': time.time()}
+        with self.lock:
+            with open(self.path, 'a') as fp:
+                fp.write(jsonlib.dumps(entry) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def load(self):
+        """
+        Every tile in the queue, in the order they first failed. A tile
+        that failed on more than one run shows up once, with the latest
+        status and the attempts added up. A half written last line (from a
+        kill mid-append) gets skipped.
+        """
+        if not os.path.exists(self.path):
+            return []
+        entries = {}
+        with open(self.path) as fp:
+            for line in fp:
+                try:
+                    entry = jsonlib.loads(line)
+                except ValueError:
+                    continue
+                old = entries.get(entry['handle'])
+                if old is not None:
+                    entry['attempts'] += old['attempts']
+                entries[entry['handle']] = entry
+        return list(entries.values())
+
+    def rewrite(self, entries):
+        """
+        Replaces the queue with entries, swapped in with os.replace so a
+        kill halfway through leaves the old queue alone.
+        """
+        tmp = self.path + '.tmp'
+        with self.lock:
+            with open(tmp, 'w') as fp:
+                for entry in entries:
+                    fp.write(jsonlib.dumps(entry) + '\n')
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmp, self.path)
+
+    def __len__(self):
+        return len(self.load())
+
+
+def checksum(*blobs):
+    """
+    sha256 hex digest over the bytes in blobs, in order.
+    """
+    digest = hashlib.sha256()
+    for blob in blobs:
+        digest.update(blob)
+    return digest.hexdigest()
+
+
+class TileManifest:
+    """
+    SQLite record of every tile the scrape plans to fetch: border row,
+    segment and index within the border (the j, k of the driver loop),
+    lat/long, where the files go, and once it's been tried the status
+    ('planned', 'done' or 'failed'), both status codes, bytes and a sha256 of
+    the image and metadata. The driver plans a border, asks pending() what's
+    left and hands record() to fetchAll() as the log, so a restart picks up
+    wherever the last run died.
+
+    Input:
+        path: the .sqlite file, made if it isn't there
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tiles (
+            row INTEGER NOT NULL,
+            seg INTEGER NOT NULL,
+            idx INTEGER NOT NULL,
+            lat REAL NOT NULL,
+            lon REAL NOT NULL,
+            handle TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'planned',
+            code1 INTEGER,
+            code2 INTEGER,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            checksum TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated REAL,
+            PRIMARY KEY (row, seg, idx)
+        )"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        #WAL keeps each record() cheap and a crash can't tear the file
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(self.SCHEMA)
+        self.db.commit()
+
+    def plan(self, row, tiles):
+        """
+        Adds a border's tiles. Tiles already in there keep their status,
+        unless the point moved (say step got changed), then it's planned
+        over again.
+
+        Input:
+            row: the border's shapefile line
+            tiles: iterable of (seg, idx, point, handle)
+        """
+        with self.lock, self.db:
+            self.db.executemany("""
+                INSERT INTO tiles (row, seg, idx, lat, lon, handle) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (row, seg, idx) DO UPDATE SET
+                    status = CASE WHEN lat = excluded.lat AND lon = excluded.lon
+                                  THEN status ELSE 'planned' END,
+                    lat = excluded.lat, lon = excluded.lon, handle = excluded.handle""",
+                [(row, seg, idx, float(point[0]), float(point[1]), handle)
+                 for seg, idx, point, handle in tiles])
+
+    def pending(self, row=None, verify=False):
+        """
+        The tiles that still need fetching: anything not 'done', plus 'done'
+        ones whose files went missing (or, with verify, don't match the
+        checksum any more).
+
+        Input:
+            row: just this border, every border if None
+            verify: re-hash the files of done tiles
+        Output:
+            tiles: (point, handle) pairs ready for fetchAll(), in border order
+        """
+        query = "SELECT lat, lon, handle, status, checksum FROM tiles"
+        args = ()
+        if row is not None:
+            query += " WHERE row = ?"
+            args = (row,)
+        with self.lock:
+            found = self.db.execute(query + " ORDER BY row, seg, idx", args).fetchall()
+        tiles = []
+        for lat, lon, handle, status, digest in found:
+            if status == 'done' and self._intact(handle, digest, verify):
+                continue
+            tiles.append(((lat, lon), handle))
+        return tiles
+
+    def done(self, handle, verify=False):
+        """
+        True if the tile at handle is recorded as done and its files are
+        still there (and match the checksum, with verify).
+        """
+        with self.lock:
+            found = self.db.execute("SELECT status, checksum FROM tiles WHERE handle = ?",
+                                    (handle,)).fetchone()
+        return found is not None and found[0] == 'done' and \
+            self._intact(handle, found[1], verify)
+
+    @staticmethod
+    def _intact(handle, digest, verify):
+        files = [handle + ext for ext in (".jpeg", ".json", ".txt")]
+        if not all(os.path.exists(name) for name in files):
+            return False
+        if not verify:
+            return True
+        blobs = []
+        for name in files[:2]:
+            with open(name, "rb") as fp:
+                blobs.append(fp.read())
+        return checksum(*blobs) == digest
+
+    def record(self, result):
+        """
+        Stores a fetch() result against its tile (matched on handle), works
+        as the log for fetchAll().
+        """
+        done = result['status'] == (200, 200)
+        with self.lock, self.db:
+            self.db.execute("""
+                UPDATE tiles SET status = ?, code1 = ?, code2 = ?, bytes = ?, checksum = ?,
+                    attempts = attempts + ?, error = ?, updated = ? WHERE handle = ?""",
+                ('done' if done else 'failed', result['status'][0], result['status'][1],
+                 result['bytes'], result.get('checksum'), result['attempts'],
+                 result['error'], time.time(), result['handle']))
+
+    def counts(self, row=None):
+        """
+        How many tiles are in each status, as a dict.
+        """
+        query = "SELECT status, COUNT(*) FROM tiles"
+        args = ()
+        if row is not None:
+            query += " WHERE row = ?"
+            args = (row,)
+        with self.lock:
+            return dict(self.db.execute(query + " GROUP BY status", args).fetchall())
+
+    def close(self):
+        self.db.close()
+
+
+def tileUrls(point, lead, jpeg, json):
+    """
+    The image and metadata urls for a (lat, long) point, same as scrape() builds.
+    """
+    where = lead + str(point[0]) + ',' + str(point[1])
+    return where + jpeg, where + json
+
+
+class TileFetcher:
+    """
+    Fetches tiles concurrently. Each tile is a (point, handle) pair, with
+    handle being the path the files get written to minus the extension
+    (handle.jpeg, handle.json and handle.txt like scrape() writes). Use
+    absolute handles, the workers don't care what directory the driver
+    is sitting in.
+
+    Input:
+        lead, jpeg, json: the url pieces from handles()
+        rate: global requests per second (image and metadata both count)
+        burst: how many requests can go out back to back after a lull,
+               anything over 1 goes over rate for a moment
+        workers: how many tiles are in flight at once
+        timeout: per request timeout in seconds
+        session: a requests.Session to share, one gets built if not given
+        retries: how many times a request gets tried again before giving up
+        base, cap: the backoff() knobs, in seconds
+        failures: a FailureQueue that tiles which still fail get put in
+    """
+    def __init__(self, lead, jpeg, json, rate=5.0, workers=8, timeout=5, session=None,
+                 retries=4, base=1.0, cap=60.0, failures=None, burst=1):
+        self.lead = lead
+        self.jpeg = jpeg
+        self.json = json
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.base = base
+        self.cap = cap
+        self.failures = failures
+        self.limiter = RateLimiter(rate, burst=max(1, burst))
+        self.session = session if session is not None else makeSession(max(workers, 1))
+
+    def get(self, url):
+        """
+        A rate limited GET through the shared session, retried with backoff
+        on connection trouble and on the RETRY_STATUS codes. A 429 with a
+        Retry-After pauses every worker for that long instead.
+
+        Input:
+            url: what to get
+        Output:
+            response, tries: the last response and how many requests it took
+        Raises the last requests exception if every try raised.
+        """
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                if attempt == self.retries:
+                    raise
+                time.sleep(backoff(attempt, self.base, self.cap))
+                continue
+            if response.status_code not in RETRY_STATUS or attempt == self.retries:
+                return response, attempt + 1
+            wait = retryAfter(response) if response.status_code == 429 else None
+            if wait is not None:
+                self.limiter.pause(min(wait, self.cap))
+            else:
+                time.sleep(backoff(attempt, self.base, self.cap))
+
+    def fetch(self, point, handle):
+        """
+        Grabs the image and metadata for one tile and writes them out.
+
+        Input:
+            point: a (lat, long) tuple
+            handle: where the files go, minus the extension
+        Output:
+            result: a dict with the handle, point, both status codes, the
+                    bytes written, their checksum, error (None unless something
+                    raised) and the number of requests it took. Anything but a pair of
+                    200s goes to the failure queue.
+        """
+        url1, url2 = tileUrls(point, self.lead, self.jpeg, self.json)
+        result = {'handle': handle, 'point': point, 'status': (None, None),
+                  'bytes': 0, 'checksum': None, 'error': None, 'attempts': 0}
+        try:
+            response1, tries = self.get(url1)
+            result['attempts'] += tries
+            response2, tries = self.get(url2)
+            result['attempts'] += tries
+        except requests.exceptions.RequestException as err:
+            result['error'] = repr(err)
+            response1 = response2 = None
+        with open(handle + ".txt", "w") as file3:
+            file3.write(str(point[0]) + "," + str(point[1]))
+            ##Collect URLs in case of a bad status code to easily manually scrape
+            if response1 is None or response1.status_code != 200 \
+               or response2.status_code != 200:
+                file3.write("\n\n" + "jpeg url: " + url1)
+                file3.write("\n\n" + "json url: " + url2)
+        if response1 is not None:
+            with open(handle + ".jpeg", "wb") as file1:
+                file1.write(response1.content)
+            with open(handle + ".json", "wb") as file2:
+                file2.write(response2.content)
+            result['status'] = (response1.status_code, response2.status_code)
+            result['bytes'] = len(response1.content) + len(response2.content)
+            result['checksum'] = checksum(response1.content, response2.content)
+        if self.failures is not None and result['status'] != (200, 200):
+            self.failures.put(result)
+        return result
+
+    def fetchAll(self, tiles, log=None):
+        """
+        Fetches a whole batch of tiles on the thread pool.
+
+        Input:
+            tiles: an iterable of (point, handle) pairs
+            log: optional function that gets each result as it finishes
+        Output:
+            results: the list of fetch() results, in the order given
+        """
+        tiles = list(tiles)
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            futures = [pool.submit(self.fetch, point, handle) for point, handle in tiles]
+            results = []
+            for fut in futures:
+                res = fut.result()
+                if log is not None:
+                    log(res)
+                results.append(res)
+        return results
+
+    def retryFailed(self, queue, log=None, manifest=None):
+        """
+        Drains queue: every tile in it gets fetched again and the queue is
+        rewritten with just the ones that still fail. Tiles the manifest
+        already has as done (a restarted run got them) are dropped without
+        fetching, so good files don't get overwritten.
+
+        Input:
+            queue: the FailureQueue to drain
+            log: same as fetchAll()
+            manifest: the TileManifest to check against, if there is one
+        Output:
+            results: the fetch() results for every tile that got fetched
+        """
+        entries = queue.load()
+        if manifest is not None:
+            entries = [e for e in entries if not manifest.done(e['handle'])]
+        #Don't let fetch() append to the queue we're about to rewrite
+        failures, self.failures = self.failures, None
+        try:
+            results = self.fetchAll([(tuple(e['point']), e['handle']) for e in entries], log)
+        finally:
+            self.failures = failures
+        still = []
+        for entry, res in zip(entries, results):
+            if res['status'] != (200, 200):
+                entry.update(status=list(res['status']), error=res['error'],
+                             attempts=entry['attempts'] + res['attempts'], time=time.time())
+                still.append(entry)
+        queue.rewrite(still)
+        return results
+
+    def close(self):
+        self.session.close()
@@ -5,6 +5,12 @@ Spec:
 This absolute unit was created to scrape the Bing Maps dataset to collect
 overhead aerial imagery of international land borders for academic research.
 THIS CODE WILL NOT RUN WITHOUT A COPY OF bingUtil.py IN THE SAME DIRECTORY!
+Usage: python bingScrapev3.py [Country1 Country2 | --only A B [C D ...] | --retry-failed]
+  Country1 Country2 starts at that border and keeps going to the end,
+  --only scrapes just the listed borders (every row of each pair),
+  --retry-failed refetches the tiles in failed_tiles.jsonl and stops.
+Every planned tile is kept in scrape_manifest.sqlite, so rerunning after a
+crash only fetches the tiles that are missing or failed.
 Enjoy the spaghetti!
 Version: 3.0
 
@@ -24,42 +30,66 @@ import json
 from haversine import haversine, Unit
 import time
 from shapely.geometry import MultiPolygon, Polygon, LineString, MultiLineString
+from bingFetch import TileFetcher, FailureQueue, TileManifest
 from bingUtilV2 import get_shape_line, fetch_key, handles, getCode, getCOW, buildList, \
-     makeMove, innerMove, scrape, buildMList, rectScrape, odometer
+     makeMove, innerMove, scrape, buildMList, rectScrape, odometer, CountryIndex, BorderIndex
 
 
-#Create file objects to pass around
-borderFile = gpd.read_file('Borders2/Int_Borders_version_2.shp')
-bingKey = fetch_key('bing_key.txt')
-csvCOW = pd.read_csv('cs_landborders_2017/cow-country-code.csv')
 #Defining the constants:
 imgSize = 1280 #Adjust this to scale the image
 zoom = 16 #Also adjust this for scaling
 step = 2 #Maybe turn this knob, too. It represents the distance between tile centers
-exL = borderFile['geometry'][1] #LineString example
-exM = borderFile['geometry'][0] #MultiLineString example
-allLines = 319
+rate = 2 #Requests per second across all the workers, keep Bing happy
+workers = 8 #Tiles in flight at once
+retries = 4 #Tries per request after the first before a tile counts as failed
+#Tiles that ran out of retries land here, absolute since we chdir around
+failed = FailureQueue('failed_tiles.jsonl')
+#Every tile we plan and how it went, this is what makes restarts cheap
+manifest = TileManifest('scrape_manifest.sqlite')
 #Handles:
+bingKey = fetch_key('bing_key.txt')
 lead, jpeg, json = handles(zoom, imgSize, bingKey)
+fetcher = TileFetcher(lead, jpeg, json, rate=rate, workers=workers,
+                      retries=retries, failures=failed)
+
+#The failure queue has everything needed, so skip the shapefile entirely
+if len(sys.argv) == 2 and sys.argv[1] == '--retry-failed':
+    results = fetcher.retryFailed(failed, log=manifest.record, manifest=manifest)
+    print(str(len(results) - len(failed)) + " of " + str(len(results)) + " failed tiles recovered")
+    sys.exit(0)
+
+#Create file objects to pass around
+borderFile = gpd.read_file('Borders2/Int_Borders_version_2.shp')
+csvCOW = pd.read_csv('cs_landborders_2017/cow-country-code.csv')
+cowIndex = CountryIndex(csvCOW) #Build the lookups once, pass this around instead
+exL = borderFile['geometry'][1] #LineString example
+exM = borderFile['geometry'][0] #MultiLineString example
+allLines = len(borderFile)
+bordIndex = BorderIndex(borderFile, cowIndex) #Country pair -> shapefile rows
 
 
 #If there's an arg given, use it to get the correct shapeline
 if len(sys.argv) == 1:
     #No arg means start from the start of the shapefile
-    shapeLine = 0
+    lines = range(0, allLines)
 elif len(sys.argv) == 3:
-    shapeLine = get_shape_line(sys.argv[1], sys.argv[2], borderFile, csvCOW)
+    shapeLine = get_shape_line(sys.argv[1], sys.argv[2], bordIndex, cowIndex)
+    lines = range(shapeLine, allLines)
+elif len(sys.argv) > 3 and sys.argv[1] == '--only' and len(sys.argv) % 2 == 0:
+    #--only A B C D ... scrapes just the A-B, C-D, ... borders
+    names = sys.argv[2:]
+    lines = bordIndex.borders(list(zip(names[0::2], names[1::2])))
 else:
     raise Exception("This isn't how this is supposed to go")
 
 
 #Now we loop the countries in the shapefile and (try to) store the things:
-for i in range(shapeLine, allLines):
+for i in lines:
     #Make the outer folder and move in
-    makeMove(borderFile, i, csvCOW)
+    makeMove(borderFile, i, cowIndex)
     #Get the list of points to scrape
     bQ = []
-    print(getCOW(borderFile['LEFT_FID'][i], csvCOW)[1] + ', ' + getCOW(borderFile['RIGHT_FID'][i], csvCOW)[1])
+    print(getCOW(borderFile['LEFT_FID'][i], cowIndex)[1] + ', ' + getCOW(borderFile['RIGHT_FID'][i], cowIndex)[1])
 
     if type(borderFile['geometry'][i]) == type(exL):
         print("LineString path")
@@ -72,21 +102,27 @@ for i in range(shapeLine, allLines):
     #reset the fileCount
     fileCount = 0
     #loop the points to scrape
-    ##REWRITE THIE ISH TO WORK WITH THE NEW bQ FORMAT#####
+    tiles = []
     for j in range(len(bQ)):
         this = bQ[j]
         for k in range(len(this)):
 
             #Set up the inner folder
-            hand = innerMove(borderFile, i, fileCount, csvCOW)
-            #scrape each point, this guy does the heavy lifting
-            # scrape(this[k], hand, lead, jpeg, json)
-            #Stall for time so we don't make Bing mad again
-            #time.sleep(5)
+            hand = innerMove(borderFile, i, fileCount, cowIndex)
+            #Plan the point, the fetcher writes to absolute paths
+            tiles.append((j, k, this[k], os.path.abspath(hand)))
             #Increment fileCount
             fileCount += 1
             #Step out into the outer folder again
             os.chdir('..')
+    #Into the manifest, then only fetch what an earlier run didn't finish.
+    #The fetcher does the rate limiting that the old time.sleep(5) was for
+    manifest.plan(i, tiles)
+    todo = manifest.pending(i)
+    results = fetcher.fetchAll(todo, log=manifest.record)
+    bad = [r for r in results if r['error'] is not None or r['status'] != (200, 200)]
+    print(str(len(tiles) - len(todo)) + " tiles already done, " + str(len(results) - len(bad))
+          + " fetched, " + str(len(bad)) + " queued for --retry-failed")
     #Step out again to start the next country
     os.chdir('..')
 
@@ -6,7 +6,6 @@ import folium
 import fiona
 import sys
 import requests
-import subprocess
 import os
 import shutil
 import json
@@ -14,6 +13,107 @@ from shapely.geometry import MultiPolygon, Polygon, LineString, MultiLineString
 from haversine import haversine, Unit
 import time
 
+# Other spellings people (and other datasets) use for COW country names.
+# Only used when the exact name isn't in the COW file.
+ALIASES = {
+    'united states': 'United States of America',
+    'us': 'United States of America',
+    'uk': 'United Kingdom',
+    'great britain': 'United Kingdom',
+    'britain': 'United Kingdom',
+    'russian federation': 'Russia',
+    'drc': 'Democratic Republic of the Congo',
+    'dr congo': 'Democratic Republic of the Congo',
+    'congo-kinshasa': 'Democratic Republic of the Congo',
+    'republic of the congo': 'Congo',
+    'congo-brazzaville': 'Congo',
+    "cote d'ivoire": 'Ivory Coast',
+    "c\u00f4te d'ivoire": 'Ivory Coast',
+    'burma': 'Myanmar',
+    'timor-leste': 'East Timor',
+    'eswatini': 'Swaziland',
+    'north macedonia': 'Macedonia',
+    'czechia': 'Czech Republic',
+}
+
+class CountryIndex:
+    """
+    Hash lookups over the COW csv, built once so getCOW and getCode don't
+    have to walk the whole file every call. Same answers as the old scans:
+    if a code or name shows up on more than one row the last row wins,
+    and misses give back ('not', 'found') and 0.
+
+    Input:
+        file: the file object of the COW csv file
+        aliases: extra {other name: COW name} pairs on top of ALIASES
+    """
+    def __init__(self, file, aliases=None):
+        codes = file['CCode'].tolist()
+        abbs = file['StateAbb'].tolist()
+        nmes = file['StateNme'].tolist()
+        self.byCode = {}
+        self.byName = {}
+        self.byFold = {}
+        for code, abr, nme in zip(codes, abbs, nmes):
+            self.byCode[code] = (abr, nme)
+            self.byName[nme] = code
+            self.byFold[str(nme).strip().casefold()] = code
+        #Abbreviations and aliases only fill gaps, real names come first
+        for code, abr in zip(codes, abbs):
+            self.byFold.setdefault(str(abr).strip().casefold(), code)
+        more = dict(ALIASES)
+        more.update(aliases or {})
+        for alt, nme in more.items():
+            if nme in self.byName:
+                self.byFold.setdefault(alt.strip().casefold(), self.byName[nme])
+
+    @classmethod
+    def fromCSV(cls, path, aliases=None):
+        """
+        Reads the COW csv at path and indexes it.
+        """
+        return cls(pd.read_csv(path), aliases)
+
+    def lookup(self, ccode):
+        """
+        Country code in, (abbreviation, full name) out, or ('not', 'found').
+        """
+        return self.byCode.get(ccode, ('not', 'found'))
+
+    def code(self, name):
+        """
+        Country name in, code out, or 0 if nothing matches. Tries the exact
+        name first, then ignoring case, then abbreviations and aliases.
+        """
+        code = self.byName.get(name)
+        if code is None:
+            code = self.byFold.get(str(name).strip().casefold(), 0)
+        return code
+
+    def __len__(self):
+        return len(self.byCode)
+
+_cowIndexes = {}
+
+def countryIndex(file):
+    """
+    Hands back the CountryIndex for file, building it the first time that
+    file shows up. Passing a CountryIndex just gives it back.
+
+    Input:
+        file: the COW csv file object or a CountryIndex
+    Output:
+        index: the CountryIndex for it
+    """
+    if isinstance(file, CountryIndex):
+        return file
+    #Keep the file in the cache too so its id can't get reused
+    hit = _cowIndexes.get(id(file))
+    if hit is None or hit[0] is not file:
+        hit = (file, CountryIndex(file))
+        _cowIndexes[id(file)] = hit
+    return hit[1]
+
 def getCOW(ccode, file):
     """
     Pass in the country code, get back a tuple with the abbreviaton
@@ -21,39 +121,107 @@ def getCOW(ccode, file):
 
     Input:
         ccode: should be an int that is a country code
-        file: the file object of the COW csv file
+        file: the file object of the COW csv file, or a CountryIndex of it
     Output:
         name: a tuple of a 3 letter abbreviation string and full name string for a country
     """
-
-    size = 243
-    name = ('not', 'found')
-    #244 lines of fun to traverse:
-    for i in range(size):
-        if file['CCode'][i] == ccode:
-            abr = file['StateAbb'][i]
-            nme = file['StateNme'][i]
-            name = (abr,nme)
-    return name
+    return countryIndex(file).lookup(ccode)
 
 def getCode(name, file):
     """
     Pass in the country name, get back the code.
 
     Input:
-        name: the correctly spelled an capitalized country  name
-        file: the file object of the COW csv file
+        name: the country name, capitalization doesn't matter and common
+              alternate names and abbreviations work too
+        file: the file object of the COW csv file, or a CountryIndex of it
     Output:
-        name: a tuple of a 3 letter abbreviation string and full name string for a country
+        code: the country code, 0 if the name isn't found
     """
+    return countryIndex(file).code(name)
 
-    size = 243
-    code = 0
-    #244 lines of fun to traverse:
-    for i in range(size):
-        if file['StateNme'][i] == name:
-            code = file['CCode'][i]
-    return code
+class BorderIndex:
+    """
+    Every border row in the shapefile filed under its unordered pair of
+    country codes, built once so finding a border is a dict lookup instead
+    of a walk down the whole file. Pairs with more than one border row keep
+    all of them, in file order. Sized off the file itself.
+
+    Input:
+        borderFile: the shapefile where the borders live
+        cow: the COW csv file (or its CountryIndex) for turning names into codes
+    """
+    def __init__(self, borderFile, cow):
+        self.cow = countryIndex(cow)
+        left = borderFile['LEFT_FID'].tolist()
+        right = borderFile['RIGHT_FID'].tolist()
+        self.size = len(left)
+        self.pairs = {}
+        for i, pair in enumerate(zip(left, right)):
+            self.pairs.setdefault(frozenset(pair), []).append(i)
+
+    def rowsByCode(self, c1, c2):
+        """
+        All the shapefile rows on the border between codes c1 and c2, in
+        either order, empty if they don't share one.
+        """
+        return list(self.pairs.get(frozenset((c1, c2)), []))
+
+    def rows(self, land1, land2):
+        """
+        All the shapefile rows on the border between two countries by name
+        (anything getCode takes), empty if they don't share one.
+        """
+        return self.rowsByCode(self.cow.code(land1), self.cow.code(land2))
+
+    def line(self, land1, land2):
+        """
+        The row get_shape_line has always handed back: the last one for
+        that pair. Raises if the pair has no land border.
+        """
+        rows = self.rows(land1, land2)
+        if not rows:
+            raise Exception("Are you sure these two have a land border?")
+        return rows[-1]
+
+    def borders(self, pairs):
+        """
+        Every row for a list of (land1, land2) pairs, in file order with no
+        repeats. Raises on a pair with no land border.
+        """
+        out = set()
+        for land1, land2 in pairs:
+            rows = self.rows(land1, land2)
+            if not rows:
+                raise Exception("Are you sure " + str(land1) + " and " + str(land2) +
+                                " have a land border?")
+            out.update(rows)
+        return sorted(out)
+
+    def __len__(self):
+        return self.size
+
+_borderIndexes = {}
+
+def borderIndex(borderFile, cow):
+    """
+    Hands back the BorderIndex for borderFile and cow, building it the first
+    time that pair shows up. Passing a BorderIndex just gives it back.
+
+    Input:
+        borderFile: the border shapefile or a BorderIndex
+        cow: the COW csv file or a CountryIndex
+    Output:
+        index: the BorderIndex for them
+    """
+    if isinstance(borderFile, BorderIndex):
+        return borderFile
+    key = (id(borderFile), id(cow))
+    hit = _borderIndexes.get(key)
+    if hit is None or hit[0] is not borderFile or hit[1] is not cow:
+        hit = (borderFile, cow, BorderIndex(borderFile, cow))
+        _borderIndexes[key] = hit
+    return hit[2]
 
 def get_shape_line(land1, land2, borderFile, cow):
     """
@@ -64,30 +232,14 @@ def get_shape_line(land1, land2, borderFile, cow):
         land1: Correctly spelled and capitalized country name
         land2: A different correctly spelled country name that has a
                land border in common with land1
-        borderFile: the shapefile where the borders live
+        borderFile: the shapefile where the borders live, or a BorderIndex
         cow: the Correlates of War csv file with all of the country codes
     Output:
         line: an int that represents the shapefile land border between
-              land1 and land2
+              land1 and land2, the last one if there's more than one (use
+              BorderIndex.rows for all of them)
     """
-
-    line = -1
-
-    size = 319
-
-    l1c = getCode(land1, cow)
-    l2c = getCode(land2, cow)
-    for i in range(size):
-        if borderFile['LEFT_FID'][i] == l1c:
-            if borderFile['RIGHT_FID'][i] == l2c:
-                line = i
-        if borderFile['LEFT_FID'][i] == l2c:
-            if borderFile['RIGHT_FID'][i] == l1c:
-                line = i
-    if line < 0:
-        raise Exception("Are you sure these two have a land border?")
-
-    return line
+    return borderIndex(borderFile, cow).line(land1, land2)
 
 def fetch_key(location):
     """
@@ -195,7 +347,7 @@ def makeMove(bf, line, cow):
 
     #Make and enter directory for this border
     outerFold = str(country1[0]).lower() + '-' + str(country2[0]).lower()
-    subprocess.call(["mkdir", outerFold])
+    os.makedirs(outerFold, exist_ok=True)
     os.chdir(outerFold)
 
     name = str(country1[1]) + '-' + str(country2[1]) + ".txt"
@@ -214,21 +366,23 @@ def innerMove(bf, line, count, cow):
          count: how many files have been made so far
     Output:
         outerFold: the name of the folder created. Handy to pass to scrape().
+                   It has the line in it, some pairs have more than one line
+                   and they all share the outer folder.
 
     """
     #Get the country names
     country1 = getCOW(bf['LEFT_FID'][line], cow)
     country2 = getCOW(bf['RIGHT_FID'][line], cow)
-    num = str(count).zfill(4)
+    num = str(line).zfill(4) + '-' + str(count).zfill(4)
 
     #Make and enter directory for this border
     outerFold = str(country1[0]).lower() + '-' + str(country2[0]).lower() + '-' + num
-    subprocess.call(["mkdir", outerFold])
+    os.makedirs(outerFold, exist_ok=True)
     os.chdir(outerFold)
 
     return outerFold
 
-def scrape(point, handle, lead, jpeg, json):
+def scrape(point, handle, lead, jpeg, json, session=None):
     """
     Does the scrape. Or tries to. If it can't, then it flags the file instead.
 
@@ -239,6 +393,8 @@ def scrape(point, handle, lead, jpeg, json):
         lead: the lead handle
         jpeg: the jpeg tail
         json: the json tail
+        session: a requests.Session to reuse connections from (see
+                 bingFetch.makeSession), plain requests.get if None
     """
 
     #Time to ping the Bing
@@ -248,27 +404,30 @@ def scrape(point, handle, lead, jpeg, json):
     url1 = lead + str(callLat) + ',' + str(callLong) + jpeg
     url2 = lead + str(callLat) + ',' + str(callLong) + json
     #Now the fancy part happens
+    get = requests.get if session is None else session.get
+    #These stay None if the request never came back
+    response1 = response2 = None
     try:
-        response1 = requests.get(url1, timeout=5)
-        response2 = requests.get(url2, timeout=5)
+        response1 = get(url1, timeout=5)
+        response2 = get(url2, timeout=5)
         response1.raise_for_status()
         response2.raise_for_status()
     except requests.exceptions.HTTPError as errh:
         print ("Http Error:",errh)
-        fileE = open('ErrorH', "wb")
-        fileE.write(url1 + '\n' + url2 + '\n' + errh)
+        with open('ErrorH', "w") as fileE:
+            fileE.write(url1 + '\n' + url2 + '\n' + str(errh))
     except requests.exceptions.ConnectionError as errc:
         print ("Error Connecting:",errc)
-        fileE = open('ErrorC', "wb")
-        fileE.write(url1 + '\n' + url2 + '\n' + errc)
+        with open('ErrorC', "w") as fileE:
+            fileE.write(url1 + '\n' + url2 + '\n' + str(errc))
     except requests.exceptions.Timeout as errt:
         print ("Timeout Error:",errt)
-        fileE = open('ErrorT', "wb")
-        fileE.write(url1 + '\n' + url2 + '\n' + errt)
+        with open('ErrorT', "w") as fileE:
+            fileE.write(url1 + '\n' + url2 + '\n' + str(errt))
     except requests.exceptions.RequestException as err:
         print ("Uh oh, something else went wrong",err)
-        fileE = open('ErrorG', "wb")
-        fileE.write(url1 + '\n' + url2 + '\n' + err)
+        with open('ErrorG', "w") as fileE:
+            fileE.write(url1 + '\n' + url2 + '\n' + str(err))
     #Not actually a requests call, so it's safe
     response3 = str(callLat) + "," + str(callLong)
 
@@ -276,17 +435,20 @@ def scrape(point, handle, lead, jpeg, json):
     header1 = handle + ".jpeg"
     header2 = handle + ".json"
     header3 = handle + ".txt"
-    #Create files
-    file1 = open(header1, "wb")
-    file1.write(response1.content)
-    file1.close()
-    file2 = open(header2, "wb")
-    file2.write(response2.content)
-    file2.close()
+    #Create files, skipping the ones we never got an answer for
+    if response1 is not None:
+        file1 = open(header1, "wb")
+        file1.write(response1.content)
+        file1.close()
+    if response2 is not None:
+        file2 = open(header2, "wb")
+        file2.write(response2.content)
+        file2.close()
     file3 = open(header3, "w")
     file3.write(response3)
     ##Collect URLs in case of bad status code to easily manually scrape
-    if response1.status_code != 200 or response2.status_code != 200:
+    if response1 is None or response2 is None \
+       or response1.status_code != 200 or response2.status_code != 200:
         file3.write("\n\n" + "jpeg url: " + url1)
         file3.write("\n\n" + "json url: " + url2)
     file3.close()
@@ -432,11 +594,11 @@ def formatTest(bf, csv):
     for testing reasons, not actually used in scraping, but still kind of useful.
     """
 
-    for i in range(319):
+    for i in range(len(bf)):
         left = getCOW(bf['LEFT_FID'][i], csv)[1]
         right = getCOW(bf['RIGHT_FID'][i], csv)[1]
-        len = str(bf['Shape_Leng'][i])
-        print("L: " + left + ' R: ' + right + " len: " + len)
+        leng = str(bf['Shape_Leng'][i])
+        print("L: " + left + ' R: ' + right + " len: " + leng)
 
     return
 
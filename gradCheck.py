@@ -0,0 +1,68 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Finite difference gradient checker. All the perturbed points go into one
+# nxm block and through the objective's batch form at once instead of two
+# full evaluations per coordinate.
+
+import numpy as np
+
+# Elements per batch call (~32MB of float64). Objectives whose batch form
+# needs a lot of memory per column (PermII's table kernel keeps an (n+1)xn
+# slab per point) say so with a colCost attribute and get chunked to fit,
+# anything else takes the whole block in one call
+CHUNK_BUDGET = 1 << 22
+
+def _evalBlock(f, X, chunk=None):
+    """ Values of f at every column of X, through f.batch if f has one
+        (chunk columns at a time, sized off CHUNK_BUDGET and f.colCost if
+        not given) and one call per column otherwise.
+    """
+    fb = getattr(f, 'batch', None)
+    m = X.shape[1]
+    if fb is None:
+        return np.array([np.asarray(f(X[:,[j]])[0]).item() for j in range(m)])
+    if chunk is None:
+        cost = getattr(f, 'colCost', None)
+        chunk = m if cost is None else max(1, CHUNK_BUDGET // cost)
+    if chunk >= m:
+        return np.asarray(fb(X)[0])
+    return np.concatenate([np.asarray(fb(X[:,j:j+chunk])[0])
+                           for j in range(0, m, chunk)])
+
+def gradCheck(f, x, h=None, method='central', chunk=None):
+    """ Compares the gradient f hands back at x against finite differences.
+        Input: f- objective returning (value, gradient), ideally carrying a
+                batch form (see A3.batched), x- nx1 point, h- step (scalar or
+                per coordinate), method- 'central' for (f(x+h)-f(x-h))/2h or
+                'complex' for Im(f(x+ih))/h, which needs an objective that
+                works on complex input, chunk- max columns per batch call
+                (if not given, the whole block unless f has a colCost)
+        Output: fd- the finite difference gradient, aerr- |g - fd| and
+                rerr- aerr relative to the bigger of |g| and |fd|, all
+                shaped like x. aerr.max() and rerr.max() are the summary.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    xc = x.reshape(-1,1)
+    n = xc.shape[0]
+    _,g = f(x)
+    g = np.asarray(g, dtype=np.float64).reshape(-1)
+    if method == 'central':
+        if h is None:
+            h = np.cbrt(np.finfo(float).eps) * np.maximum(1, np.abs(xc[:,0]))
+        H = np.diag(np.broadcast_to(h, (n,)).astype(np.float64))
+        # Columns 0..n-1 step forward, n..2n-1 step back
+        v = _evalBlock(f, np.hstack([xc + H, xc - H]), chunk)
+        fd = (v[:n] - v[n:]) / (2*np.diagonal(H))
+    elif method == 'complex':
+        if h is None:
+            h = 1e-20
+        H = np.diag(np.broadcast_to(h, (n,)).astype(np.float64))
+        v = _evalBlock(f, xc + 1j*H, chunk)
+        fd = np.imag(v) / np.diagonal(H)
+    else:
+        raise Exception("Unknown method: " + str(method))
+    aerr = np.abs(g - fd)
+    den = np.maximum(np.maximum(np.abs(g), np.abs(fd)), np.finfo(float).tiny)
+    rerr = aerr / den
+    return fd.reshape(x.shape), aerr.reshape(x.shape), rerr.reshape(x.shape)
@@ -0,0 +1,143 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Multi-start driver for the A3 optimizers. PermII has plenty of local
+# minima, so instead of trusting one random start we throw K of them at a
+# process pool and keep the best.
+
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+from A3 import myPerm, mySteep, myBFGS
+
+# Name -> (solver, keyword args). Looked up by name inside the workers so
+# only the name has to be pickled.
+SOLVERS = {
+    'steep': (mySteep, {}),
+    'steep-wolfe': (mySteep, {'ls': 'wolfe'}),
+    'bfgs': (myBFGS, {}),
+    'bfgs-wolfe': (myBFGS, {'ls': 'wolfe'}),
+    'lbfgs': (myBFGS, {'mem': 10, 'ls': 'wolfe'}),
+}
+
+# Environment knobs the common BLAS builds read at load time
+BLAS_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+             'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+def _pinThreads(k):
+    """ Pool initializer, caps BLAS at k threads in this worker. The
+        environment variables only count if they're set before numpy loads,
+        which myMultiStart takes care of, threadpoolctl handles the rest.
+    """
+    for var in BLAS_VARS:
+        os.environ[var] = str(k)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(k)
+
+def _runStart(f, x, tol, solver, idx):
+    """ Runs one start and hands back a dict with the result and timing.
+    """
+    fn,kw = SOLVERS[solver]
+    stats = {}
+    t = time.perf_counter()
+    try:
+        opt,val,n = fn(x, tol, f, stats=stats, **kw)
+        err = None
+    except Exception as e:
+        opt,val,n,err = x, np.inf, 0, str(e)
+    return {
+        'start': idx, 'opt': opt, 'val': float(np.asarray(val).item()),
+        'n': n, 'its': stats.get('its'), 'time': time.perf_counter() - t,
+        'error': err,
+    }
+
+def randStarts(n, K, lo=0.0, hi=1.0, seed=None):
+    """ K random nx1 starting points drawn uniformly from [lo, hi)^n.
+    """
+    rng = np.random.default_rng(seed)
+    return [lo + (hi - lo)*rng.random((n,1)) for k in range(K)]
+
+def myMultiStart(f, starts, tol, solver='bfgs', workers=None, target=None,
+                 threads=1):
+    """ Runs solver from every point in starts and keeps the best result.
+        Inputs: f- the function to be minimized, has to be picklable (a
+                module level function or an object like QuadObjective),
+                starts- list of starting points, tol- tolerance,
+                solver- a name from SOLVERS, workers- pool size (None for
+                one per core, 0 to run in this process), target- stop
+                handing out starts once some start gets val <= target,
+                threads- BLAS threads per worker
+        Output: opt- the best optimum found, val- the function value at opt,
+                n- total calls to f over all finished starts,
+                runs- per-start dicts (start, opt, val, n, its, time, error)
+                in the order they finished
+    """
+    if solver not in SOLVERS:
+        raise Exception("Unknown solver: " + str(solver))
+    runs = []
+    if workers == 0:
+        for idx,x in enumerate(starts):
+            runs.append(_runStart(f, x, tol, solver, idx))
+            if target is not None and runs[-1]['val'] <= target:
+                break
+    else:
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) // threads)
+        # Spawned workers read the environment when they boot, so set the
+        # BLAS caps before any of them exist and put things back after
+        saved = {var: os.environ.get(var) for var in BLAS_VARS}
+        for var in BLAS_VARS:
+            os.environ[var] = str(threads)
+        ctx = mp.get_context('spawn')
+        ex = ProcessPoolExecutor(workers, mp_context=ctx,
+                                 initializer=_pinThreads, initargs=(threads,))
+        try:
+            futs = [ex.submit(_runStart, f, x, tol, solver, idx)
+                    for idx,x in enumerate(starts)]
+        finally:
+            for var,v in saved.items():
+                if v is None:
+                    os.environ.pop(var, None)
+                else:
+                    os.environ[var] = v
+        try:
+            for fut in as_completed(futs):
+                runs.append(fut.result())
+                if target is not None and runs[-1]['val'] <= target:
+                    # Starts still waiting in the queue get dropped, the
+                    # ones already running finish on their own
+                    for other in futs:
+                        other.cancel()
+                    break
+        finally:
+            ex.shutdown(wait=True, cancel_futures=True)
+    if not runs:
+        raise Exception("No starts were run!")
+    best = min(runs, key=lambda run: run['val'])
+    n = sum(run['n'] for run in runs)
+    return best['opt'], best['val'], n, runs
+
+
+########################################################################
+##################### Main Method ######################################
+########################################################################
+if __name__ == '__main__':
+
+    n = 5
+    K = 16
+    permMin = 1 / np.arange(1, n+1).reshape(-1,1)
+    starts = randStarts(n, K, seed=0)
+    t = time.perf_counter()
+    opt,val,calls,runs = myMultiStart(myPerm, starts, 1e-6, 'bfgs-wolfe',
+                                      target=1e-8)
+    print("Ran", len(runs), "of", K, "starts in",
+          '{0:.3f}'.format(time.perf_counter() - t), "s,", calls, "calls to f")
+    for run in sorted(runs, key=lambda run: run['start']):
+        print("start {start:3d}  val={val:.3e}  n={n:<6d} its={its}".format(**run))
+    print("Best value: ", val)
+    print("Difference to true minimizer:\n", abs(opt-permMin))
@@ -0,0 +1,85 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Memoizing wrapper for expensive objectives.
+
+import hashlib
+from collections import OrderedDict
+import numpy as np
+
+class CachedObjective:
+    """ Wraps an objective f(x) -> (value, gradient) and remembers the last
+        maxsize points it saw, keyed on a hash of the point's raw bytes
+        (plus shape and dtype), evicting the least recently used one.
+        hits and misses count lookups, so misses is the number of unique
+        evaluations f actually did. Everything handed out is a copy, so
+        callers can scribble on it without poisoning the cache.
+    """
+    def __init__(self, f, maxsize=128):
+        self.f = f
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if getattr(f, 'batch', None) is not None:
+            self.batch = self._batch
+
+    def key(self, x):
+        """ Cache key for the point x.
+        """
+        x = np.ascontiguousarray(x)
+        h = hashlib.blake2b(x.tobytes(), digest_size=16)
+        return (h.digest(), x.shape, x.dtype.str)
+
+    def _lookup(self, k):
+        hit = self.cache.get(k)
+        if hit is not None:
+            self.cache.move_to_end(k)
+            self.hits += 1
+        return hit
+
+    def _store(self, k, r, g):
+        # Hands the entry back, with a small maxsize it can get evicted
+        # before anyone reads it out of the cache
+        self.misses += 1
+        entry = (np.array(r, copy=True), np.array(g, copy=True))
+        self.cache[k] = entry
+        while len(self.cache) > max(self.maxsize, 0):
+            self.cache.popitem(last=False)
+        return entry
+
+    def __call__(self, x):
+        k = self.key(x)
+        hit = self._lookup(k)
+        if hit is None:
+            r,g = self.f(x)
+            hit = self._store(k, r, g)
+        return hit[0].copy(), hit[1].copy()
+
+    def _batch(self, X):
+        """ Batch form, only the columns of X that aren't cached get sent
+            on to f.batch.
+        """
+        X = np.asarray(X)
+        m = X.shape[1]
+        keys = [self.key(X[:,[j]]) for j in range(m)]
+        found = [self._lookup(k) for k in keys]
+        miss = [j for j in range(m) if found[j] is None]
+        if miss:
+            r,g = self.f.batch(X[:,miss])
+            for i,j in enumerate(miss):
+                found[j] = self._store(keys[j], r[i], g[:,[i]])
+        r = np.array([np.asarray(hit[0]).item() for hit in found])
+        g = np.hstack([hit[1] for hit in found])
+        return r,g
+
+    def __getattr__(self, name):
+        # Q, b and friends come straight from the wrapped objective
+        if name == 'f':
+            raise AttributeError(name)
+        return getattr(self.f, name)
+
+    def clear(self):
+        """ Drops everything cached, the counters stay.
+        """
+        self.cache.clear()
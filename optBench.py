@@ -0,0 +1,231 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Benchmark harness for the A-series optimizers.
+#
+# Usage:
+#   python optBench.py [--quad 5 20 50] [--perm 5 10] [--seeds 0 1 2]
+#                      [--lowrank N ...] [--banded N ...] [--ortho N ...]
+#                      [--solvers steep bfgs ...] [--out bench.json]
+#                      [--repeat 3] [--baseline old.json] [--slack 0.25]
+#                      [--no-mem] [--perm-kernel auto|table|stream|numba]
+#                      [--opts opts.json] [--dtype float32]
+# Writes a JSON report, and if a baseline report is given, compares against
+# it and exits with status 1 when a case got slower.
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from A3 import randQuad, myPerm, myPermBatch, mySteep, myBFGS, myMin
+from quadUtil import QuadObjective, randQuadLowRank, randQuadBanded, randQuadOrtho, norm64
+from optOptions import SolverOptions
+import permII
+
+# Solver registry, name -> callable(x, tol, f, stats, opts) -> (opt, val, n),
+# opts being a SolverOptions or None for the defaults.
+# Add new solvers here and they show up in the grid.
+SOLVERS = {
+    'steep': lambda x,tol,f,st,op=None: mySteep(x, tol, f, stats=st, opts=op),
+    'steep-wolfe': lambda x,tol,f,st,op=None: mySteep(x, tol, f, ls='wolfe', stats=st, opts=op),
+    'bfgs': lambda x,tol,f,st,op=None: myBFGS(x, tol, f, stats=st, opts=op),
+    'bfgs-wolfe': lambda x,tol,f,st,op=None: myBFGS(x, tol, f, ls='wolfe', stats=st, opts=op),
+    'lbfgs': lambda x,tol,f,st,op=None: myBFGS(x, tol, f, mem=10, ls='wolfe', stats=st, opts=op),
+    'auto': lambda x,tol,f,st,op=None: myMin(x, tol, f, stats=st, ls='wolfe', opts=op),
+}
+
+class CountedObjective:
+    """ Wraps an objective and counts how many points it gets evaluated
+        at, whether they come in one at a time or through the batch form.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.calls = 0
+        self.points = 0
+        if getattr(f, 'batch', None) is not None:
+            self.batch = self._batch
+
+    def __call__(self, x):
+        self.calls += 1
+        self.points += 1
+        return self.f(x)
+
+    def __getattr__(self, name):
+        # Anything we don't count (Q, b, ...) comes from the objective
+        if name == 'f':
+            raise AttributeError(name)
+        return getattr(self.f, name)
+
+    def _batch(self, X):
+        self.calls += 1
+        self.points += np.shape(X)[1]
+        return self.f.batch(X)
+
+# Structured quadratic generators from quadUtil, cheap to set up at large n
+STRUCTURED = {
+    'lowrank': randQuadLowRank,
+    'banded': randQuadBanded,
+    'ortho': randQuadOrtho,
+}
+
+def makeProblem(kind, n, seed, dtype=np.float64):
+    """ Builds the test problem kind ('quad', 'perm' or one of STRUCTURED)
+        of dimension n from the given seed, returns the objective and the
+        starting point. With dtype=np.float32 the quadratics hold Q and b
+        in float32 and the start point is float32, so the solvers run
+        in float32 too. Same seed, same problem, whatever the dtype.
+    """
+    np.random.seed(seed)
+    if kind == 'quad':
+        Q,b = randQuad(n, dtype)
+        return QuadObjective(Q,b,dtype), (np.random.rand(n,1)*10).astype(dtype)
+    if kind in STRUCTURED:
+        Q,b = STRUCTURED[kind](n, cond=1e3)
+        return QuadObjective(Q,b,dtype), (np.random.rand(n,1)*10).astype(dtype)
+    if kind == 'perm':
+        f = lambda y:myPerm(y)
+        f.batch = myPermBatch
+        return f, np.random.rand(n,1).astype(dtype)
+    raise Exception("Unknown problem kind: " + str(kind))
+
+def runCase(solver, kind, n, seed, tol=1e-4, mem=True, repeat=3, opts=None,
+            dtype=np.float64):
+    """ Runs one solver on one problem and returns a dict of measurements:
+        wall time (best of repeat runs), evaluations, iterations, final
+        gradient norm, and the peak traced allocation (None if mem is False).
+        opts is a SolverOptions handed to the solver, None for the defaults.
+        The problem is built in dtype, and the answer is always rechecked
+        on the float64 problem: val64/gnorm64 are the value and gradient
+        norm there and val_err how far the reported value is from val64.
+    """
+    f,x = makeProblem(kind, n, seed, dtype)
+    wall = np.inf
+    for k in range(repeat):
+        cf = CountedObjective(f)
+        stats = {}
+        t = time.perf_counter()
+        try:
+            opt,val,cnt = SOLVERS[solver](x.copy(), tol, cf, stats, opts)
+            err = None
+        except Exception as e:
+            opt,val,cnt,err = x, np.nan, -1, str(e)
+        wall = min(wall, time.perf_counter() - t)
+    peak = None
+    if mem and err is None:
+        # Separate run so tracing doesn't skew the timing
+        f,x = makeProblem(kind, n, seed, dtype)
+        tracemalloc.start()
+        SOLVERS[solver](x.copy(), tol, f, {}, opts)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    _,g = f(opt)
+    f64,_ = makeProblem(kind, n, seed) if dtype != np.float64 else (f, None)
+    v64,g64 = f64(np.asarray(opt, dtype=np.float64))
+    v64 = float(np.asarray(v64).item())
+    return {
+        'solver': solver, 'problem': kind, 'n': n, 'seed': seed,
+        'time': wall, 'evals': cf.points, 'calls': cf.calls,
+        'reported_n': int(cnt), 'its': stats.get('its'),
+        'stalled': stats.get('stalled', False),
+        'val': float(np.asarray(val).item()) if err is None else None,
+        'gnorm': float(norm64(g)), 'peak_bytes': peak, 'error': err,
+        'dtype': np.dtype(dtype).name, 'val64': v64,
+        'gnorm64': float(norm64(g64)),
+        'val_err': abs(float(np.asarray(val).item()) - v64) / max(1.0, abs(v64))
+                   if err is None else None,
+    }
+
+def runGrid(solvers, cases, seeds, tol=1e-4, mem=True, repeat=3, log=print,
+            opts=None, dtype=np.float64):
+    """ Runs every solver over the (problem kind, dimension) cases and
+        seeds given, returns the list of case results.
+    """
+    out = []
+    for kind,n in cases:
+        for solver in solvers:
+            for seed in seeds:
+                res = runCase(solver, kind, n, seed, tol, mem, repeat, opts, dtype)
+                out.append(res)
+                log('{solver:12s} {problem:7s} n={n:<6d} seed={seed:<3d} '
+                    'time={time:.4f}s evals={evals:<6d} its={its} '
+                    'gnorm={gnorm:.2e} gnorm64={gnorm64:.2e}'.format(**res))
+    return out
+
+def caseKey(res):
+    return (res['solver'], res['problem'], res['n'], res['seed'])
+
+def checkBaseline(results, baseline, slack=0.25, floor=1e-2):
+    """ Compares results against a baseline list of results. A case counts
+        as a regression when its time grew by more than slack (relative,
+        ignoring anything under floor seconds) or it needs more evaluations.
+        Returns a list of (key, what, old, new) tuples.
+    """
+    old = {caseKey(r): r for r in baseline}
+    bad = []
+    for r in results:
+        o = old.get(caseKey(r))
+        if o is None:
+            continue
+        if r['time'] > max(o['time'], floor) * (1 + slack):
+            bad.append((caseKey(r), 'time', o['time'], r['time']))
+        if r['evals'] > o['evals']:
+            bad.append((caseKey(r), 'evals', o['evals'], r['evals']))
+    return bad
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the A-series optimizers")
+    ap.add_argument('--quad', type=int, nargs='*', default=[5, 20, 50])
+    ap.add_argument('--perm', type=int, nargs='*', default=[5, 10])
+    for kind in STRUCTURED:
+        ap.add_argument('--' + kind, type=int, nargs='*', default=[])
+    ap.add_argument('--seeds', type=int, nargs='*', default=[0, 1, 2])
+    ap.add_argument('--solvers', nargs='*', default=['steep', 'bfgs'],
+                    choices=sorted(SOLVERS))
+    ap.add_argument('--tol', type=float, default=1e-4)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--out', default='bench.json')
+    ap.add_argument('--baseline', default=None)
+    ap.add_argument('--slack', type=float, default=0.25)
+    ap.add_argument('--no-mem', action='store_true')
+    ap.add_argument('--perm-kernel', default=None, choices=permII.KERNELS)
+    ap.add_argument('--dtype', default='float64', choices=['float64', 'float32'])
+    ap.add_argument('--opts', default=None,
+                    help="SolverOptions JSON, e.g. from optOptions.py")
+    args = ap.parse_args(argv)
+    opts = None if args.opts is None else SolverOptions.load(args.opts)
+    if args.perm_kernel is not None:
+        permII.setKernel(args.perm_kernel)
+
+    cases = [('quad', n) for n in args.quad] + [('perm', n) for n in args.perm]
+    for kind in STRUCTURED:
+        cases += [(kind, n) for n in getattr(args, kind)]
+    results = runGrid(args.solvers, cases, args.seeds, args.tol,
+                      not args.no_mem, args.repeat, opts=opts,
+                      dtype=np.dtype(args.dtype))
+    report = {
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'machine': platform.machine(), 'tol': args.tol,
+        'perm_kernel': permII._kernel, 'dtype': args.dtype,
+        'opts': None if opts is None else opts.asdict(), 'results': results,
+    }
+    with open(args.out, 'w') as fp:
+        json.dump(report, fp, indent=1)
+    print("Wrote " + args.out)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as fp:
+        baseline = json.load(fp)['results']
+    bad = checkBaseline(results, baseline, args.slack)
+    for key,what,o,nw in bad:
+        print("REGRESSION " + str(key) + ' ' + what + ': ' + str(o) + ' -> ' + str(nw))
+    if bad:
+        return 1
+    print("No regressions against " + args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Checkpoints for long A3 optimizer runs. Pass ckpt=Checkpoint('run.npz')
+# to mySteep/myBFGS/myLBFGS and every `every` iterations the full solver
+# state (point, value, gradient, inverse Hessian or (s,y) history, counters,
+# line search carry-over) gets written to one .npz. A3.myResume picks the
+# run back up from that file and takes exactly the steps the uninterrupted
+# run would have.
+
+import os
+import numpy as np
+
+class Checkpoint:
+    """ Where and how often a solver snapshots itself. state holds a
+        loaded snapshot until the solver picks it up with take().
+    """
+    def __init__(self, path, every=50):
+        self.path = path
+        self.every = every
+        self.state = None
+
+    def due(self, i):
+        """ True if iteration i (counting from 0) should end in a save.
+        """
+        return self.every > 0 and (i+1) % self.every == 0
+
+    def save(self, **state):
+        """ Writes the arrays/scalars in state to path. It goes to a temp
+            file first and gets swapped in with os.replace, so a kill in
+            the middle of a save leaves the last good checkpoint alone.
+        """
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as fp:
+            np.savez(fp, every=self.every, **state)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self.path)
+
+    def load(self):
+        """ Reads the snapshot at path into state and returns it.
+        """
+        with np.load(self.path, allow_pickle=False) as d:
+            self.state = {k: d[k] for k in d.files}
+        return self.state
+
+    def take(self):
+        """ Hands the loaded snapshot over (None if there isn't one) and
+            forgets it, so it only gets resumed from once.
+        """
+        state = self.state
+        self.state = None
+        return state
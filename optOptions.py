@@ -0,0 +1,185 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Tunable knobs for the A3 optimizers, and a sweep that picks them.
+#
+# Usage:
+#   python optOptions.py [--solver steep|steep-wolfe|bfgs|bfgs-wolfe|lbfgs]
+#                        [--quad 5 20] [--perm 5] [--seeds 0 1]
+#                        [--metric evals|time] [--tol 1e-4] [--its 1000]
+#                        [--out opts.json]
+# Sweeps the line search settings over the sample problems and writes the
+# best ones to JSON, hand that to the solvers with SolverOptions.load() or
+# to optBench.py with --opts.
+
+import itertools
+import json
+import time
+import numpy as np
+from numpy import linalg as la
+
+class SolverOptions:
+    """ Everything mySteep/myBFGS/myLBFGS used to hard-code.
+        its- max iterations, r- backtracking reduction factor, a- first
+        trial step, c- sufficient decrease constant and gamma- curvature
+        constant for mySearch, nb- trial steps per batch call, c1, c2-
+        the myWolfe constants, dtype- 'float32' to run the iterates and
+        inverse Hessian in float32 (None keeps whatever x comes in as).
+        r and a left at None mean the solver's own default (r=0.25, a=4
+        for mySteep, r=0.85, a=1 for the BFGS ones).
+    """
+    FIELDS = ('its', 'r', 'a', 'c', 'gamma', 'nb', 'c1', 'c2', 'dtype')
+
+    def __init__(self, its=1000, r=None, a=None, c=1e-4, gamma=0.95, nb=4,
+                 c1=1e-4, c2=0.9, dtype=None):
+        self.its = its
+        self.r = r
+        self.a = a
+        self.c = c
+        self.gamma = gamma
+        self.nb = nb
+        self.c1 = c1
+        self.c2 = c2
+        self.dtype = None if dtype is None else np.dtype(dtype).name
+
+    def pick(self, name, default):
+        """ The setting name, or default if it was left at None.
+        """
+        v = getattr(self, name)
+        return default if v is None else v
+
+    def update(self, **kw):
+        """ A copy with the given settings changed.
+        """
+        d = self.asdict()
+        d.update(kw)
+        return SolverOptions(**d)
+
+    def asdict(self):
+        return {k: getattr(self, k) for k in self.FIELDS}
+
+    def __repr__(self):
+        return 'SolverOptions(' + ', '.join(
+            '{0}={1!r}'.format(k, v) for k,v in self.asdict().items()) + ')'
+
+    def __eq__(self, other):
+        return isinstance(other, SolverOptions) and self.asdict() == other.asdict()
+
+    def toJSON(self):
+        return json.dumps(self.asdict())
+
+    @classmethod
+    def fromJSON(cls, s):
+        d = json.loads(s)
+        bad = set(d) - set(cls.FIELDS)
+        if bad:
+            raise Exception("Unknown solver options: " + ', '.join(sorted(bad)))
+        return cls(**d)
+
+    def save(self, path):
+        """ Writes the settings to a JSON file.
+        """
+        with open(path, 'w') as fp:
+            json.dump(self.asdict(), fp, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        """ Reads settings written by save() (or by hand, missing keys get
+            the defaults).
+        """
+        with open(path) as fp:
+            return cls.fromJSON(fp.read())
+
+# What tuneOptions sweeps when it isn't given a grid. myWolfe doesn't
+# backtrack so r and c mean nothing to it, WOLFE_GRID is for ls='wolfe'
+GRID = {
+    'r': [0.25, 0.5, 0.85],
+    'a': [1, 4],
+    'c': [1e-4, 1e-2],
+}
+WOLFE_GRID = {
+    'a': [1, 4],
+    'c1': [1e-4, 1e-2],
+    'c2': [0.5, 0.9],
+}
+
+def tuneOptions(solver, problems, grid=None, metric='evals', tol=1e-4,
+                base=None, repeat=1, log=None):
+    """ Tries every combination in grid on every problem and returns the
+        best SolverOptions along with the scores.
+        Inputs: solver- callable(x, tol, f, opts) -> (opt, val, n), problems-
+                list of (f, x0) pairs, grid- dict of setting -> values to try
+                (GRID by default), metric- 'evals' adds up the n the solver
+                reports, 'time' adds up wall time (best of repeat), base-
+                SolverOptions the grid gets laid on top of, log- optional
+                print-like function
+        Output: best- the winning SolverOptions, None if nothing converged,
+                table- list of (settings dict, score) for every combination,
+                a combination that raises or doesn't get the gradient under
+                tol on any problem scores inf
+    """
+    grid = GRID if grid is None else grid
+    base = SolverOptions() if base is None else base
+    keys = sorted(grid)
+    table = []
+    best, bestScore = None, np.inf
+    for combo in itertools.product(*(grid[k] for k in keys)):
+        setting = dict(zip(keys, combo))
+        opts = base.update(**setting)
+        score = 0.0
+        for f,x in problems:
+            try:
+                wall = np.inf
+                for k in range(repeat):
+                    t = time.perf_counter()
+                    opt,_,n = solver(x.copy(), tol, f, opts)
+                    wall = min(wall, time.perf_counter() - t)
+                if la.norm(f(opt)[1]) > tol:
+                    raise Exception("Didn't converge")
+                score += wall if metric == 'time' else n
+            except Exception:
+                score = np.inf
+                break
+        table.append((setting, score))
+        if log is not None:
+            log('{0} -> {1}'.format(setting, score))
+        if score < bestScore:
+            best, bestScore = opts, score
+    return best, table
+
+def main(argv=None):
+    import argparse
+    from optBench import makeProblem, SOLVERS
+    ap = argparse.ArgumentParser(description="Tune the A3 line search settings")
+    ap.add_argument('--solver', default='steep',
+                    choices=sorted(k for k in SOLVERS if k != 'auto'))
+    ap.add_argument('--quad', type=int, nargs='*', default=[5, 20])
+    ap.add_argument('--perm', type=int, nargs='*', default=[5])
+    ap.add_argument('--seeds', type=int, nargs='*', default=[0, 1])
+    ap.add_argument('--metric', default='evals', choices=['evals', 'time'])
+    ap.add_argument('--tol', type=float, default=1e-4)
+    ap.add_argument('--its', type=int, default=1000)
+    ap.add_argument('--out', default='opts.json')
+    args = ap.parse_args(argv)
+
+    problems = [makeProblem(kind, n, seed)
+                for kind,dims in (('quad', args.quad), ('perm', args.perm))
+                for n in dims for seed in args.seeds]
+    run = SOLVERS[args.solver]
+    solver = lambda x,tol,f,opts: run(x, tol, f, {}, opts)
+    wolfe = 'wolfe' in args.solver or args.solver == 'lbfgs'
+    best, table = tuneOptions(solver, problems, WOLFE_GRID if wolfe else GRID,
+                              args.metric, args.tol, SolverOptions(its=args.its),
+                              log=print)
+    if best is None:
+        #Saving the defaults here would look like they'd been tuned
+        print("Nothing converged to " + str(args.tol) + ", try a looser --tol "
+              "or a bigger --its. Not writing " + args.out)
+        return 1
+    best.save(args.out)
+    print("Best:", best)
+    print("Wrote " + args.out)
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
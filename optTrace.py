@@ -0,0 +1,94 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Per-iteration tracing for the A3 optimizers. Pass a TraceRecorder (or any
+# function with the same signature) as callback= and it gets called once
+# per iteration with
+#   callback(it, alfa, n, gnorm, val, t_obj, t_lin)
+# where n is the running call count, t_obj the seconds spent inside the
+# objective that iteration and t_lin everything else (line search logic,
+# Hessian updates, ...).
+
+import time
+import numpy as np
+
+TRACE_DTYPE = np.dtype([
+    ('it', np.int64), ('alfa', np.float64), ('n', np.int64),
+    ('gnorm', np.float64), ('val', np.float64),
+    ('t_obj', np.float64), ('t_lin', np.float64),
+])
+
+class TraceRecorder:
+    """ Collects the per-iteration trace into one preallocated structured
+        array that doubles when it fills up, so a long run costs a few
+        stores per iteration instead of a dict apiece.
+    """
+    def __init__(self, capacity=1024):
+        self.buf = np.zeros(capacity, dtype=TRACE_DTYPE)
+        self.size = 0
+
+    def __call__(self, it, alfa, n, gnorm, val, t_obj, t_lin):
+        if self.size == len(self.buf):
+            self.buf = np.resize(self.buf, 2*len(self.buf))
+        self.buf[self.size] = (it, alfa, n, gnorm, val, t_obj, t_lin)
+        self.size += 1
+
+    @property
+    def data(self):
+        """ The recorded rows so far (a view, no copy).
+        """
+        return self.buf[:self.size]
+
+    def summary(self):
+        """ Totals over the run: iterations, calls, final value and gradient
+            norm, and time in the objective versus everything else.
+        """
+        d = self.data
+        if self.size == 0:
+            return {'its': 0}
+        return {
+            'its': self.size, 'n': int(d['n'][-1]),
+            'val': float(d['val'][-1]), 'gnorm': float(d['gnorm'][-1]),
+            't_obj': float(d['t_obj'].sum()), 't_lin': float(d['t_lin'].sum()),
+        }
+
+    def save(self, path):
+        """ Writes the trace to a .npy file.
+        """
+        np.save(path, self.data)
+
+    def clear(self):
+        self.size = 0
+
+class TimedObjective:
+    """ Wraps an objective and adds up the time spent inside it (batch
+        form included). take() hands back the time since the last take().
+        Other attributes come from the wrapped objective.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.spent = 0.0
+        if getattr(f, 'batch', None) is not None:
+            self.batch = self._batch
+
+    def __call__(self, x):
+        t = time.perf_counter()
+        out = self.f(x)
+        self.spent += time.perf_counter() - t
+        return out
+
+    def _batch(self, X):
+        t = time.perf_counter()
+        out = self.f.batch(X)
+        self.spent += time.perf_counter() - t
+        return out
+
+    def take(self):
+        spent = self.spent
+        self.spent = 0.0
+        return spent
+
+    def __getattr__(self, name):
+        if name == 'f':
+            raise AttributeError(name)
+        return getattr(self.f, name)
@@ -0,0 +1,254 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Vectorized PermII evaluation shared by the A-series scripts.
+
+import os
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Which kernel PermII.batch uses when an engine doesn't pick one itself:
+#   'table'  - the (n+1,n,m) power table, fastest for small n
+#   'stream' - plain NumPy, walks i in blocks so memory stays O(n*m)
+#   'numba'  - compiled loops, parallel over i for the inner sums and over
+#              l for the gradient, O(n*m) memory. Needs numba installed
+#   'auto'   - table up to TABLE_MAX, then numba if it's there, else stream
+KERNELS = ('auto', 'table', 'stream', 'numba')
+TABLE_MAX = 2048
+STREAM_BUDGET = 1 << 22 # Elements per block in the stream kernel (~32MB)
+_kernel = os.environ.get('PERM_KERNEL', 'auto')
+
+def setKernel(name):
+    """ Picks the default kernel for every engine (see KERNELS) and
+        returns the old one.
+    """
+    global _kernel
+    if name not in KERNELS:
+        raise Exception("Unknown PermII kernel: " + str(name))
+    if name == 'numba' and numba is None:
+        raise Exception("The numba kernel needs numba installed")
+    old = _kernel
+    _kernel = name
+    return old
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _nbInner(X, w, c):
+        # inner[i-1,col] = sum_j w_j*(x_j^i - j^-i). Each of the c chunks
+        # of i gets a thread with its own running x^i and j^-i rows, the
+        # sum over j is the inner loop so it vectorizes
+        n, m = X.shape
+        S = np.empty((n, m))
+        rj = 1 / np.arange(1.0, n+1)
+        size = (n + c - 1) // c
+        for t in numba.prange(c):
+            i0 = t*size
+            i1 = min(n, i0 + size)
+            for col in range(m):
+                x = X[:,col].copy()
+                p = x**(i0+1)
+                q = rj**(i0+1)
+                for i in range(i0, i1):
+                    s = 0.0
+                    for j in range(n):
+                        s += w[j]*(p[j] - q[j])
+                        p[j] *= x[j]
+                        q[j] *= rj[j]
+                    S[i,col] = s
+        return S
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _nbGrad(X, w, S, c):
+        # g_l = (l+10) * sum_i 2*inner_i*i*x_l^(i-1), each of the c chunks
+        # of l gets a thread, the inner loop runs down its chunk
+        n, m = X.shape
+        G = np.empty((n, m))
+        size = (n + c - 1) // c
+        for t in numba.prange(c):
+            l0 = min(n, t*size)
+            l1 = min(n, l0 + size)
+            for col in range(m):
+                x = X[l0:l1,col].copy()
+                p = np.ones(l1 - l0)
+                acc = np.zeros(l1 - l0)
+                for i in range(n):
+                    s = 2*S[i,col]*(i+1)
+                    for l in range(l1 - l0):
+                        acc[l] += s*p[l]
+                        p[l] *= x[l]
+                G[l0:l1,col] = w[l0:l1]*acc
+        return G
+
+class PermII:
+    """ Precomputes the pieces of the n-dimensional PermII function that
+        only depend on n, so the value and gradient can be built from a
+        power table in a handful of array ops instead of nested loops.
+        f(x) = sum_i ( sum_j (j+10)*(x_j^i - j^-i) )^2,  i,j = 1..n
+    """
+    def __init__(self, n, kernel=None):
+        self.n = n
+        self.kernel = kernel # None follows the module default
+        j = np.arange(1, n+1, dtype=np.float64)
+        self.i = j.copy()                     # the exponents 1..n
+        self.w = j + 10                       # the (j+10) weights
+        self._c = None
+
+    @property
+    def c(self):
+        """ c_i = sum_j (j+10)*j^-i, only the table kernel needs it and it
+            costs an nxn table to build, so it waits until then.
+        """
+        if self._c is None:
+            jpow = self.i[None,:] ** -self.i[:,None] # jpow[i-1,j-1] = j^-i
+            self._c = np.matmul(jpow, self.w)
+        return self._c
+
+    def pick(self, X):
+        """ The kernel this engine will use on the block X.
+        """
+        k = self.kernel or _kernel
+        if k == 'auto':
+            if self.n <= TABLE_MAX:
+                k = 'table'
+            elif numba is not None and X.dtype == np.float64:
+                k = 'numba'
+            else:
+                k = 'stream'
+        return k
+
+    @property
+    def colCost(self):
+        """ Elements batch() keeps live per column of X. The table kernel
+            holds an (n+1)xn slab of powers per point, the others O(n).
+            gradCheck sizes its chunks off this.
+        """
+        k = self.kernel or _kernel
+        if k == 'table' or (k == 'auto' and self.n <= TABLE_MAX):
+            return (self.n+1)*self.n
+        return self.n
+
+    def powers(self, X):
+        """ Takes an (n,m) block X and returns the (n+1,n,m) table of
+            X^0 through X^n, built with a running product.
+        """
+        P = np.empty((self.n+1,) + X.shape, dtype=np.result_type(X, 1.0))
+        P[0] = 1
+        np.cumprod(np.broadcast_to(X, (self.n,) + X.shape), axis=0, out=P[1:])
+        return P
+
+    def batch(self, X):
+        """ Takes an (n,m) block of m points and returns r,g where r is the
+            m-vector of PermII values and g is the (n,m) matrix of gradients.
+        """
+        X = np.asarray(X)
+        k = self.pick(X)
+        if k == 'numba':
+            if numba is None:
+                raise Exception("The numba kernel needs numba installed")
+            return self.numbaBatch(X)
+        if k == 'stream':
+            return self.streamBatch(X)
+        return self.tableBatch(X)
+
+    def tableBatch(self, X):
+        """ batch() off the full power table, O(n^2*m) memory.
+        """
+        P = self.powers(X)
+        # Inner sums for every i at once: (n,m)
+        inner = np.einsum('ijm,j->im', P[1:], self.w) - self.c[:,None]
+        r = np.einsum('im,im->m', inner, inner)
+        # d/dx_l of inner_i is (l+10)*i*x_l^(i-1), so chain rule gives
+        # g_l = (l+10) * sum_i 2*inner_i*i*x_l^(i-1)
+        g = np.einsum('ijm,im->jm', P[:-1], 2*self.i[:,None]*inner)
+        g *= self.w[:,None]
+        return r,g
+
+    def streamBatch(self, X, block=None):
+        """ batch() walking i in blocks of rows of the power table (block
+            rows at a time, sized off STREAM_BUDGET if not given), carrying
+            x^i and j^-i over from one block to the next, so only O(n*m)
+            stays live between blocks.
+        """
+        n,m = X.shape
+        dt = np.result_type(X, 1.0)
+        if block is None:
+            block = max(1, STREAM_BUDGET // (n*m))
+        rj = 1 / self.i
+        p = np.ones((n,m), dtype=dt) # x^(i0) at the top of each block
+        q = np.ones(n)               # j^-(i0)
+        r = np.zeros(m, dtype=dt)
+        g = np.zeros((n,m), dtype=dt)
+        for i0 in range(0, n, block):
+            k = min(block, n - i0)
+            P = np.empty((k+1, n, m), dtype=dt)
+            P[0] = p
+            np.cumprod(np.broadcast_to(X, (k, n, m)), axis=0, out=P[1:])
+            P[1:] *= p
+            J = np.cumprod(np.broadcast_to(rj, (k, n)), axis=0) * q
+            inner = np.einsum('tjm,j->tm', P[1:], self.w) - np.matmul(J, self.w)[:,None]
+            r += np.einsum('tm,tm->m', inner, inner)
+            g += np.einsum('tjm,tm->jm', P[:-1], 2*self.i[i0:i0+k,None]*inner)
+            p = P[k].copy()
+            q = J[-1]
+        g *= self.w[:,None]
+        return r,g
+
+    def numbaBatch(self, X):
+        """ batch() through the compiled kernels, float64 only.
+        """
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        c = min(self.n, 8*numba.get_num_threads())
+        S = _nbInner(X, self.w, c)
+        r = np.einsum('im,im->m', S, S)
+        return r, _nbGrad(X, self.w, S, c)
+
+    def __call__(self, x):
+        """ Takes the nx1 vector x as input and returns r,g where r is the value
+            of the PermII function evaluated at x and g is the gradient of the
+            PermII function at x. Shapes match the old looped myPerm.
+        """
+        x = np.asarray(x)
+        r,g = self.batch(x.reshape(self.n, -1))
+        return r.reshape(x.shape[1:]), g.reshape(x.shape)
+
+_engines = {}
+
+def permEngine(n, kernel=None):
+    """ Hands back the PermII engine for dimension n (and kernel, None
+        meaning whatever setKernel last picked), building it the first time
+        that combination shows up.
+    """
+    eng = _engines.get((n, kernel))
+    if eng is None:
+        eng = PermII(n, kernel)
+        _engines[(n, kernel)] = eng
+    return eng
+
+def permVal(x):
+    """ Takes an nx1 vector x and returns the PermII value with the
+        same shape permIt used to give back.
+    """
+    return permEngine(np.size(x))(x)[0]
+
+def permRef(x):
+    """ The original triple loop PermII, kept around as the reference
+        the vectorized engine gets checked against.
+    """
+    r = 0
+    g = np.zeros(x.shape)
+    n = x.size
+    for i in range(1,n+1):
+        r_i = 0
+        g_i = np.zeros(x.shape)
+        for j in range(1,n+1):
+            r_i += (j + 10)*(x[j-1]**i - (1/(j**i)))
+        g_i[:] = 2*r_i
+        r += r_i**2
+        for l in range(1,n+1):
+            g_i[l-1] = g_i[l-1]*(10 + l)*(i * x[l-1]**(i-1))
+        g += g_i
+    return r,g
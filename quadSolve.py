@@ -0,0 +1,122 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Direct and conjugate gradient solvers for the quadratic
+# f(x) = 0.5*x^T*Q*x - b^T*x. Same (opt, val, n) contract as mySteep, but
+# they take a QuadObjective so they can get at Q and b.
+
+import numpy as np
+from numpy import linalg as la
+try:
+    from scipy.linalg import cho_factor, cho_solve
+except ImportError:
+    cho_factor = None
+
+def quadVal(x, g, f):
+    """ f(x) from x and the gradient g = Q*x - b without another product:
+        0.5*x^T*Q*x - b^T*x = 0.5*x^T*(g - b)
+    """
+    b = f.b if np.ndim(x) == 2 else f.b.reshape(-1)
+    return 0.5 * np.matmul(np.transpose(x), g - b)
+
+def triSolve(T, b, lower=True):
+    """ Solves T*x = b for triangular T by forward (lower) or back
+        substitution, O(n^2) per solve. Only used when scipy isn't around
+        to do it for us.
+    """
+    x = np.array(b, dtype=np.result_type(T, b, np.float64))
+    y = x.reshape(np.shape(T)[0], -1)
+    order = range(len(y)) if lower else reversed(range(len(y)))
+    for i in order:
+        part = slice(0, i) if lower else slice(i+1, None)
+        y[i] = (y[i] - T[i,part] @ y[part]) / T[i,i]
+    return x
+
+def myChol(x, tol, f, stats=None):
+    """ Solves Q*x = b with a Cholesky factorization of Q, which gets
+        computed once and kept on the objective so later solves against
+        the same Q are just two triangular solves.
+        Inputs: x- starting point (only its shape matters), tol- tolerance
+                (unused, the solve is direct), f- a QuadObjective with dense Q
+        Output: opt- the minimizer, val- the function value at opt
+                n- the number of calls to f
+    """
+    if not isinstance(f.Q, np.ndarray):
+        raise Exception("myChol needs a dense Q, use myCG for sparse ones")
+    if f.factor is None:
+        if cho_factor is not None:
+            f.factor = cho_factor(f.Q)
+        else:
+            #No scipy, keep L from Q = L*L^T and substitute with it
+            f.factor = la.cholesky(f.Q)
+    if cho_factor is not None:
+        opt = cho_solve(f.factor, f.b)
+    else:
+        opt = triSolve(f.factor.T, triSolve(f.factor, f.b), lower=False)
+    opt = opt.reshape(np.shape(x))
+    val,_ = f(opt)
+    if stats is not None:
+        stats['its'] = 0
+    return opt, val, 1
+
+def jacobi(Q):
+    """ Diagonal preconditioner for Q, or None if Q can't tell us its
+        diagonal (a MatVecOp, say).
+    """
+    if isinstance(Q, np.ndarray):
+        d = np.diagonal(Q).copy()
+    elif hasattr(Q, 'diagonal'):
+        d = np.asarray(Q.diagonal()).ravel()
+    else:
+        return None
+    d[d == 0] = 1
+    return lambda r: r / d.reshape((-1,) + (1,)*(np.ndim(r)-1))
+
+def myCG(x, tol, f, M='jacobi', its=None, stats=None):
+    """ Preconditioned conjugate gradient for the quadratic in f.
+        Inputs: x- the starting point, tol- tolerance on the gradient norm,
+                f- a QuadObjective (dense, sparse or matrix-free Q),
+                M- preconditioner, a function applying M^-1 to a vector,
+                'jacobi' for the diagonal or None, its- iteration cap,
+                n by default
+        Output: opt- the approximate optimum, val- the function value at opt
+                n- the number of calls to f plus products with Q
+    """
+    if isinstance(M, str):
+        M = jacobi(f.Q) if M == 'jacobi' else None
+    if its is None:
+        its = f.n
+    opt = np.array(x, dtype=np.float64)
+    _,g = f(opt)
+    n = 1
+    r = -g # Residual b - Q*x
+    z = r if M is None else M(r)
+    p = z.copy()
+    rz = np.vdot(r, z)
+    for i in range(its):
+        if la.norm(r) < tol:
+            break
+        Qp = f.Q @ p
+        n += 1
+        alfa = rz / np.vdot(p, Qp)
+        opt += alfa*p
+        r -= alfa*Qp
+        z = r if M is None else M(r)
+        rzn = np.vdot(r, z)
+        p *= rzn / rz
+        p += z
+        rz = rzn
+    else:
+        i = its
+    if stats is not None:
+        stats['its'] = i
+    return opt, quadVal(opt, -r, f), n
+
+def myQuadMin(x, tol, f, stats=None):
+    """ Picks the quadratic solver for f: Cholesky for dense Q up to a few
+        thousand dimensions, Jacobi preconditioned CG for anything bigger,
+        sparse or matrix-free.
+    """
+    if isinstance(f.Q, np.ndarray) and f.n <= 5000:
+        return myChol(x, tol, f, stats)
+    return myCG(x, tol, f, stats=stats)
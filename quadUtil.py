@@ -0,0 +1,202 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Quadratic objective helpers shared by the A-series scripts.
+
+import numpy as np
+from numpy import linalg as la
+
+def isOperator(Q):
+    """ True if Q is something that only knows how to multiply (a sparse
+        matrix, a MatVecOp, a scipy LinearOperator) rather than an array
+        we're allowed to convert.
+    """
+    return (not isinstance(Q, np.ndarray) and hasattr(Q, 'shape')
+            and hasattr(Q, '__matmul__'))
+
+class MatVecOp:
+    """ A symmetric n x n matrix known only through its product. matvec
+        has to take an n-vector or an nxm block and return the same shape.
+    """
+    def __init__(self, n, matvec, dtype=np.float64):
+        self.shape = (n, n)
+        self.dtype = np.dtype(dtype)
+        self.matvec = matvec
+
+    def __matmul__(self, X):
+        return self.matvec(np.asarray(X))
+
+    def dot(self, X):
+        return self.matvec(np.asarray(X))
+
+def asOperator(Q, n):
+    """ Hands back Q in a form QuadObjective can multiply with, without ever
+        building a dense copy: sparse matrices go to CSR (float64), objects
+        that only have a matvec method or are plain functions get wrapped in
+        a MatVecOp, and anything else with an @ is used as is. Returns None
+        for things that should be treated as dense arrays.
+    """
+    if hasattr(Q, 'tocsr'):
+        return Q.tocsr().astype(np.float64, copy=False)
+    if isOperator(Q):
+        return Q
+    if hasattr(Q, 'matvec'):
+        return MatVecOp(n, Q.matvec)
+    if callable(Q):
+        return MatVecOp(n, Q)
+    return None
+
+def dot64(u, v):
+    """ u^T*v summed in float64 whatever u and v are stored as, so float32
+        vectors still get a float64 reduction. Plain np.vdot for float64.
+    """
+    if u.dtype == np.float64 and v.dtype == np.float64:
+        return np.vdot(u, v)
+    return np.sum(np.multiply(u, v, dtype=np.float64))
+
+def norm64(g):
+    """ ||g|| accumulated in float64, same deal as dot64.
+    """
+    if g.dtype == np.float64:
+        return la.norm(g)
+    return np.sqrt(np.sum(np.square(g, dtype=np.float64)))
+
+def _col(v, X):
+    """ Shapes the n-vector v so it broadcasts down the rows of X.
+    """
+    return v.reshape((-1,) + (1,)*(np.ndim(X)-1))
+
+def _spectrum(n, cond):
+    """ n eigenvalues log-spaced from 1 to cond.
+    """
+    return np.logspace(0, np.log10(cond), n)
+
+def randQuadLowRank(n, k=10, cond=1e4):
+    """ Takes an integer n and returns Q,b where Q = D + U*U^T is diagonal
+        plus rank k, stored as the diagonal and the n x k factor behind a
+        MatVecOp, and b is a random nx1 vector. The eigenvalues of Q sit
+        in [1, cond]. Setup and each product are O(n*k).
+    """
+    d = _spectrum(n, 0.5*cond)
+    U = np.random.rand(n, k) - 0.5
+    #||U*U^T|| <= ||U||_F^2, scaling that to cond/2 keeps the top in range
+    U *= np.sqrt(0.5*cond) / la.norm(U)
+    def matvec(X):
+        return _col(d, X)*X + np.matmul(U, np.matmul(U.transpose(), X))
+    b = np.random.rand(n,1)
+    return MatVecOp(n, matvec), b
+
+def randQuadBanded(n, bw=2, cond=1e4):
+    """ Takes an integer n and returns Q,b where Q is a random symmetric
+        banded matrix with bw bands either side of the diagonal, as a
+        scipy.sparse CSR matrix, and b is a random nx1 vector. The diagonal
+        runs from 1.5 to cond+0.5 and the off-diagonals add at most 0.5 per
+        row, so the eigenvalues sit in [1, cond+1]. Needs scipy.
+    """
+    import scipy.sparse as sp
+    s = 0.5 / (2*bw) # Off-diagonal magnitude cap
+    diags = [_spectrum(n, cond) + 0.5]
+    offs = [0]
+    for k in range(1, bw+1):
+        v = (2*np.random.rand(n-k) - 1) * s
+        diags += [v, v]
+        offs += [k, -k]
+    Q = sp.diags(diags, offs, shape=(n,n), format='csr')
+    b = np.random.rand(n,1)
+    return Q, b
+
+def randQuadOrtho(n, cond=1e4, k=3):
+    """ Takes an integer n and returns Q,b where Q = H*D*H^T with D a
+        log-spaced spectrum from 1 to cond and H a product of k random
+        Householder reflections, so the condition number is exactly cond.
+        Q comes back as a MatVecOp that costs O(k*n) per product, b is a
+        random nx1 vector.
+    """
+    d = _spectrum(n, cond)
+    V = np.random.rand(k, n) - 0.5
+    V /= np.sqrt(np.sum(V*V, axis=1, keepdims=True))
+    def reflect(v, X):
+        #(I - 2*v*v^T)*X
+        return X - 2*np.multiply.outer(v, np.matmul(v, X))
+    def matvec(X):
+        for v in V[::-1]:
+            X = reflect(v, X)
+        X = _col(d, X)*X
+        for v in V:
+            X = reflect(v, X)
+        return X
+    b = np.random.rand(n,1)
+    return MatVecOp(n, matvec), b
+
+class QuadObjective:
+    """ The quadratic f(x) = 0.5*x^T*Q*x - b^T*x with Q and b held as
+        contiguous float64 arrays. They get converted once here and never
+        copied again, and Q*x is computed once per call and reused for
+        both the value and the gradient. Q can also be a scipy.sparse
+        matrix, a LinearOperator or MatVecOp, or just a function doing
+        Q*x, none of those ever get densified (see asOperator) so memory
+        and cost per call follow nnz(Q).
+        With dtype=np.float32 Q, b and the gradients are float32 (half
+        the bytes per matvec) and real points get cast to float32 on the
+        way in, the value is still summed and handed back in float64.
+    """
+    def __init__(self, Q, b, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.b = np.ascontiguousarray(np.reshape(b, (-1,1)), dtype=self.dtype)
+        self.n = self.b.shape[0]
+        self.Q = asOperator(Q, self.n)
+        if self.Q is None:
+            self.Q = np.ascontiguousarray(Q, dtype=self.dtype)
+        elif self.dtype != np.float64 and hasattr(self.Q, 'tocsr'):
+            self.Q = self.Q.astype(self.dtype)
+        self._qx = np.empty((self.n,1), dtype=self.dtype)
+        # Preallocated gradient buffer, pass it in as out= to keep the
+        # steady state allocation free. The next call with out=self.out
+        # overwrites it, so copy anything you need to hang on to.
+        self.out = np.empty((self.n,1), dtype=self.dtype)
+        # Cholesky factor of Q, filled in the first time quadSolve.myChol
+        # sees this objective and reused after that
+        self.factor = None
+
+    def __call__(self, x, out=None):
+        """ Takes an nx1 vector x and returns r,g where r is the value of
+            f at x and g is the gradient Q*x - b, written into out if given.
+        """
+        x = self._cast(x)
+        b = self.b if x.ndim == 2 else self.b.reshape(-1)
+        if isinstance(self.Q, np.ndarray) and x.shape == self._qx.shape \
+           and x.dtype == self.dtype:
+            qx = np.matmul(self.Q, x, out=self._qx)
+        else:
+            qx = self.Q @ x
+        if self.dtype == np.float64 or np.iscomplexobj(x):
+            r = 0.5 * np.matmul(x.transpose(), qx) - np.matmul(b.transpose(), x)
+        else:
+            r = np.full(x.shape[1:] + x.shape[1:], 0.5*dot64(x, qx) - dot64(b, x))
+        g = np.subtract(qx, b, out=out)
+        return r,g
+
+    def _cast(self, x):
+        """ Points come in as whatever the caller had, in float32 mode real
+            ones get cast so the matvec doesn't upcast Q.
+        """
+        x = np.asarray(x)
+        if self.dtype != np.float64 and x.dtype != self.dtype \
+           and not np.iscomplexobj(x):
+            x = x.astype(self.dtype)
+        return x
+
+    def batch(self, X):
+        """ Takes an nxm block X whose columns are points and returns the
+            m-vector of values and the nxm matrix of gradients, using a
+            single Q*X product for the whole block.
+        """
+        X = self._cast(X)
+        QX = self.Q @ X
+        if self.dtype == np.float64 or np.iscomplexobj(X):
+            r = 0.5 * np.einsum('ij,ij->j', X, QX) - np.matmul(self.b.reshape(-1), X)
+        else:
+            r = 0.5 * np.einsum('ij,ij->j', X, QX, dtype=np.float64) \
+                - np.einsum('i,ij->j', self.b.reshape(-1), X, dtype=np.float64)
+        QX -= self.b
+        return r,QX
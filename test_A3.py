@@ -0,0 +1,26 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Regression cases for the A3 line searches. Run with python -m pytest.
+
+import numpy as np
+import pytest
+import A3
+from quadUtil import QuadObjective, randQuadOrtho, norm64
+
+def wolfeCase(name):
+    # Problems where myWolfe used to raise once f stopped resolving the
+    # decrease near the minimum
+    if name == 'ortho':
+        np.random.seed(0)
+        Q,b = randQuadOrtho(2000, cond=1e3)
+        return QuadObjective(Q,b), np.zeros((2000,1)), 1e-6
+    np.random.seed(1)
+    Q,b = A3.randQuad(50)
+    return QuadObjective(Q,b), np.random.rand(50,1), 1e-6
+
+@pytest.mark.parametrize('name,mem', [('ortho', 10), ('quad', 0), ('quad', 50)])
+def test_wolfe_converges_near_roundoff(name, mem):
+    f,x,tol = wolfeCase(name)
+    opt,val,n = A3.myBFGS(x, tol, f, mem=mem, ls='wolfe')
+    assert norm64(f(opt)[1]) <= tol
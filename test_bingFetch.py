@@ -0,0 +1,226 @@
+# Andrew Dunn
+#
+# Runs the tile fetcher against a local http.server standing in for Bing.
+# Run with python -m pytest.
+
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pandas as pd
+import pytest
+from bingFetch import TileFetcher, TileManifest, FailureQueue
+from bingUtilV2 import makeMove, innerMove, CountryIndex
+
+JPEG = '/16?mapSize=1280,1280&mapMetadata=0&key=KEY'
+JSON = '/16?mapSize=1280,1280&mapMetadata=1&key=KEY'
+
+
+class StubBing(BaseHTTPRequestHandler):
+    """
+    Answers every GET with a fake tile (or metadata), after server.delay
+    seconds. Points with a latitude of 9 get a 404, like a bad tile would.
+    server.script maps a point ('lat,long') to a list of (status, headers)
+    to answer with first, server.down is points that always get a 500, and
+    server.log keeps (time, point, status) for every request.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        now = time.monotonic()
+        self.server.hits.append(now)
+        time.sleep(self.server.delay)
+        point = self.path.split('/')[1]
+        meta = 'mapMetadata=1' in self.path
+        body = b'{"meta": 1}' if meta else b'\xff\xd8' + self.path.encode()
+        headers = {}
+        with self.server.lock:
+            script = self.server.script.get(point)
+            if script:
+                status, headers = script.pop(0)
+            elif point in self.server.down:
+                status = 500
+            else:
+                status = 404 if point.startswith('9.0,') else 200
+            self.server.log.append((now, point, status))
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubBing)
+    server.hits = []
+    server.delay = 0
+    server.script = {}
+    server.down = set()
+    server.log = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.lead = 'http://127.0.0.1:' + str(server.server_port) + '/'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def tiles(tmp_path, lats):
+    return [((float(lat), 2.5), str(tmp_path / ('t' + str(k)))) for k, lat in enumerate(lats)]
+
+
+def test_fetch_writes_tiles(stub, tmp_path):
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=3, retries=0)
+    todo = tiles(tmp_path, [1, 2, 9, 4])
+    results = fetcher.fetchAll(todo)
+    fetcher.close()
+    assert [r['handle'] for r in results] == [handle for _, handle in todo]
+    assert [r['status'] for r in results] == [(200, 200), (200, 200), (404, 404), (200, 200)]
+    assert (tmp_path / 't1.jpeg').read_bytes().startswith(b'\xff\xd8/2.0,2.5/16')
+    assert (tmp_path / 't1.json').read_bytes() == b'{"meta": 1}'
+    assert (tmp_path / 't1.txt').read_text() == '2.0,2.5'
+    #Bad tiles keep their urls around for scraping by hand
+    assert 'jpeg url: ' + stub.lead + '9.0,2.5' + JPEG in (tmp_path / 't2.txt').read_text()
+
+
+def test_fetch_is_concurrent(stub, tmp_path):
+    stub.delay = 0.1
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=8, retries=0)
+    start = time.monotonic()
+    fetcher.fetchAll(tiles(tmp_path, range(8)))
+    fetcher.close()
+    #16 requests at 0.1s each would take 1.6s one after another
+    assert time.monotonic() - start < 0.8
+
+
+def test_rate_limit_holds_from_the_start(stub, tmp_path):
+    rate = 20
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=rate, workers=8, retries=0)
+    fetcher.fetchAll(tiles(tmp_path, range(5)))
+    fetcher.close()
+    hits = sorted(stub.hits)
+    assert len(hits) == 10
+    #burst=1, so even the first few requests come 1/rate apart
+    assert hits[-1] - hits[0] >= 0.9 * (len(hits) - 1) / rate
+    assert hits[2] - hits[0] >= 0.9 * 2 / rate
+
+
+def test_retry_5xx_then_ok(stub, tmp_path):
+    stub.script['3.0,2.5'] = [(503, {}), (502, {})]
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=1, retries=3, base=0.01)
+    result = fetcher.fetch((3.0, 2.5), str(tmp_path / 't'))
+    fetcher.close()
+    assert result['status'] == (200, 200)
+    assert result['error'] is None
+    #Two tries that got a 5xx, the image on the third, then the metadata
+    assert result['attempts'] == 4
+    assert (tmp_path / 't.jpeg').read_bytes().startswith(b'\xff\xd8')
+
+
+def test_429_retry_after_pauses_every_worker(stub, tmp_path):
+    stub.script['1.0,2.5'] = [(429, {'Retry-After': '1'})]
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=4, retries=2, base=0.01)
+    results = fetcher.fetchAll(tiles(tmp_path, [1] + [2]*7))
+    fetcher.close()
+    assert all(r['status'] == (200, 200) for r in results)
+    told = [t for t, point, status in stub.log if status == 429][0]
+    #Past whatever was already in flight when the 429 came back, nothing
+    #went out for the Retry-After second, from any worker
+    after = [t - told for t, point, status in stub.log if t > told]
+    assert not [t for t in after if 0.1 < t < 0.9]
+    retried = [t - told for t, point, status in stub.log if point == '1.0,2.5' and t > told]
+    assert min(retried) >= 0.9
+
+
+def test_exhausted_tiles_queue_and_retry(stub, tmp_path):
+    queue = FailureQueue(str(tmp_path / 'failed.jsonl'))
+    stub.down.add('5.0,2.5')
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=3, retries=2, base=0.01,
+                          failures=queue)
+    fetcher.fetchAll(tiles(tmp_path, [1, 5, 9]))
+    entries = queue.load()
+    assert sorted(e['point'][0] for e in entries) == [5.0, 9.0]
+    down = [e for e in entries if e['point'][0] == 5.0][0]
+    assert down['handle'] == str(tmp_path / 't1')
+    assert down['status'] == [500, 500]
+    assert down['attempts'] == 6 # 1 + 2 retries, image and metadata both
+    #5 comes back up, 9 is still a 404, only 9 should be left queued
+    stub.down.clear()
+    results = fetcher.retryFailed(queue)
+    fetcher.close()
+    assert sorted(r['status'] for r in results) == [(200, 200), (404, 404)]
+    left = queue.load()
+    assert [e['point'][0] for e in left] == [9.0]
+    assert left[0]['attempts'] == 2 + 2
+    assert (tmp_path / 't1.jpeg').read_bytes().startswith(b'\xff\xd8/5.0,2.5')
+
+
+def test_manifest_multi_row_border(stub, tmp_path, monkeypatch):
+    #Rows 5 and 7 are both the US-Canada border, like the shapefile has
+    bf = pd.DataFrame({'LEFT_FID': [2]*10, 'RIGHT_FID': [20]*10})
+    cow = CountryIndex(pd.DataFrame({'StateAbb': ['USA', 'CAN'], 'CCode': [2, 20],
+                                     'StateNme': ['United States of America', 'Canada']}))
+    monkeypatch.chdir(tmp_path)
+    manifest = TileManifest(str(tmp_path / 'manifest.sqlite'))
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=4, retries=0)
+    for row in (5, 7):
+        #Same as the driver, fileCount starts over for every row
+        makeMove(bf, row, cow)
+        planned = []
+        for k in range(3):
+            hand = innerMove(bf, row, k, cow)
+            planned.append((0, k, (float(row), float(k)), os.path.abspath(hand)))
+            monkeypatch.chdir('..')
+        monkeypatch.chdir('..')
+        manifest.plan(row, planned)
+        fetcher.fetchAll(manifest.pending(row), log=manifest.record)
+    assert manifest.counts() == {'done': 6}
+    assert manifest.pending(verify=True) == []
+    #Each row kept its own files
+    for row in ('5', '7'):
+        hand = 'usa-can-000' + row + '-0001'
+        assert (tmp_path / 'usa-can' / hand / (hand + '.txt')).read_text() == row + '.0,1.0'
+    #A restart has nothing left to fetch
+    stub.hits.clear()
+    for row in (5, 7):
+        fetcher.fetchAll(manifest.pending(row), log=manifest.record)
+    assert stub.hits == []
+    fetcher.close()
+    manifest.close()
+
+
+def test_retry_failed_respects_manifest(stub, tmp_path):
+    queue = FailureQueue(str(tmp_path / 'failed.jsonl'))
+    manifest = TileManifest(str(tmp_path / 'manifest.sqlite'))
+    fetcher = TileFetcher(stub.lead, JPEG, JSON, rate=0, workers=2, retries=0,
+                          failures=queue)
+    todo = tiles(tmp_path, [1, 2])
+    manifest.plan(0, [(0, k, point, handle) for k, (point, handle) in enumerate(todo)])
+    #Both down on the first run, 2 stays down on the restart too
+    stub.down.update({'1.0,2.5', '2.0,2.5'})
+    fetcher.fetchAll(manifest.pending(0), log=manifest.record)
+    stub.down.discard('1.0,2.5')
+    fetcher.fetchAll(manifest.pending(0), log=manifest.record)
+    assert manifest.counts() == {'done': 1, 'failed': 1}
+    with open(queue.path) as fp:
+        assert len(fp.readlines()) == 3 # 1 once, 2 twice
+    good = (tmp_path / 't0.jpeg').read_bytes()
+
+    #1 going down again must not matter, the restart already got it
+    stub.down = {'1.0,2.5'}
+    stub.log.clear()
+    results = fetcher.retryFailed(queue, log=manifest.record, manifest=manifest)
+    fetcher.close()
+    assert [r['point'] for r in results] == [(2.0, 2.5)]
+    #2 went out once (image and metadata), not once per time it was queued
+    assert sorted(point for _, point, _ in stub.log) == ['2.0,2.5', '2.0,2.5']
+    assert queue.load() == []
+    assert (tmp_path / 't0.jpeg').read_bytes() == good
+    assert manifest.counts() == {'done': 2}
+    manifest.close()
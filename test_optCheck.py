@@ -0,0 +1,47 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Interrupts A3 runs partway through and checks that myResume finishes them
+# exactly the way the uninterrupted run does. Run with python -m pytest.
+
+import numpy as np
+import pytest
+import A3
+from optCheck import Checkpoint
+from quadUtil import QuadObjective
+
+class Interrupt(Exception):
+    pass
+
+def stopAt(k):
+    """ A callback that kills the run at iteration k.
+    """
+    def callback(i, *rest):
+        if i == k:
+            raise Interrupt()
+    return callback
+
+RUNS = {
+    'steep': lambda x,f,**kw: A3.mySteep(x, 1e-6, f, **kw),
+    'steep-wolfe': lambda x,f,**kw: A3.mySteep(x, 1e-6, f, ls='wolfe', **kw),
+    'bfgs': lambda x,f,**kw: A3.myBFGS(x, 1e-8, f, **kw),
+    'bfgs-wolfe': lambda x,f,**kw: A3.myBFGS(x, 1e-4, f, ls='wolfe', **kw),
+    'lbfgs': lambda x,f,**kw: A3.myBFGS(x, 1e-8, f, mem=5, **kw),
+}
+
+@pytest.mark.parametrize('name', sorted(RUNS))
+def test_resume_matches(name, tmp_path):
+    np.random.seed(1)
+    Q,b = A3.randQuad(30)
+    f = QuadObjective(Q,b) # Has a batch form, so mySearch hands back columns
+    x = np.random.rand(30,1)
+    run = RUNS[name]
+    opt,val,n = run(x.copy(), f)
+
+    path = str(tmp_path / 'run.npz')
+    with pytest.raises(Interrupt):
+        run(x.copy(), f, ckpt=Checkpoint(path, every=7), callback=stopAt(7))
+    rOpt,rVal,rN = A3.myResume(path, f)
+    assert np.array_equal(opt, rOpt)
+    assert np.array_equal(val, rVal)
+    assert n == rN
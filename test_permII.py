@@ -0,0 +1,67 @@
+# Andrew Dunn
+# M/CS 435
+#
+# Checks every PermII kernel against permRef, the original triple loop.
+# Run with python -m pytest.
+
+import numpy as np
+import pytest
+import permII
+from permII import PermII, permRef, permVal
+
+KERNELS = [
+    'table',
+    'stream',
+    pytest.param('numba', marks=pytest.mark.skipif(permII.numba is None,
+                                                   reason="numba isn't installed")),
+]
+DIMS = [1, 5, 12]
+
+def points(n, m, seed=0):
+    # Spread over [-1, 1], PermII blows up fast outside of that
+    return np.random.default_rng(seed).uniform(-1, 1, (n, m))
+
+def refBatch(X):
+    # permRef one column at a time, as an m-vector and an (n,m) block
+    out = [permRef(X[:,[j]]) for j in range(X.shape[1])]
+    return np.array([r.item() for r,_ in out]), np.hstack([g for _,g in out])
+
+@pytest.mark.parametrize('kernel', KERNELS)
+@pytest.mark.parametrize('n', DIMS)
+def test_single_point(kernel, n):
+    x = points(n, 1)
+    r,g = PermII(n, kernel)(x)
+    rRef,gRef = permRef(x)
+    assert np.shape(r) == np.shape(rRef)
+    assert np.shape(g) == np.shape(gRef)
+    np.testing.assert_allclose(r, rRef, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(g, gRef, rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize('kernel', KERNELS)
+@pytest.mark.parametrize('n', DIMS)
+def test_batch(kernel, n):
+    X = points(n, 7, seed=n)
+    r,g = PermII(n, kernel).batch(X)
+    rRef,gRef = refBatch(X)
+    assert r.shape == (7,)
+    assert g.shape == (n, 7)
+    np.testing.assert_allclose(r, rRef, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(g, gRef, rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize('block', [1, 2, 5])
+def test_stream_blocks(block):
+    # Small blocks make the stream kernel carry x^i and j^-i across blocks
+    n = 12
+    X = points(n, 4, seed=1)
+    r,g = PermII(n, 'stream').streamBatch(X, block=block)
+    rRef,gRef = refBatch(X)
+    np.testing.assert_allclose(r, rRef, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(g, gRef, rtol=1e-10, atol=1e-12)
+
+@pytest.mark.parametrize('n', DIMS)
+def test_permVal(n):
+    x = points(n, 1, seed=2)
+    r = permVal(x)
+    rRef,_ = permRef(x)
+    assert np.shape(r) == np.shape(rRef)
+    np.testing.assert_allclose(r, rRef, rtol=1e-10, atol=1e-12)